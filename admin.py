@@ -0,0 +1,97 @@
+import asyncio
+import secrets
+import threading
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from clients import pool_stats
+from monitoring import sample_stacks
+
+
+def build_admin_router(admin_api_key, tracker, scheduler, history_cache, history_buffer, ai_caller, rate_limiter):
+    """Admin endpoints for runtime introspection, guarded by the X-ADMIN-API-KEY header."""
+
+    def require_admin(x_admin_api_key: str | None = Header(default=None)):
+        # compare bytes: compare_digest raises TypeError on non-ASCII str
+        if not x_admin_api_key or not secrets.compare_digest(x_admin_api_key.encode(), admin_api_key.encode()):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin API key.")
+
+    router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+    # Handlers are `async def` so they run on the event loop thread: the
+    # structures they read are mutated by the loop and aren't thread-safe.
+
+    @router.get("/tasks")
+    async def tasks():
+        return {
+            "tasks": tracker.snapshot(),
+            "queued_per_org": scheduler.queued(),
+        }
+
+    @router.get("/caches")
+    async def caches():
+        lookups = history_cache.hits + history_cache.misses
+        return {
+            "history_cache": {
+                "entries": len(history_cache),
+                "max_entries": history_cache.max_entries,
+                "hits": history_cache.hits,
+                "misses": history_cache.misses,
+                "hit_rate": round(history_cache.hits / lookups, 4) if lookups else None,
+            },
+            "history_buffer": {
+                "pending": len(history_buffer),
+                "awaiting_key": history_buffer.awaiting_key,
+                "flushed": history_buffer.flushed,
+                "failed": history_buffer.failed,
+            },
+            "rate_limiter": rate_limiter.backend.stats(),
+        }
+
+    @router.get("/connections")
+    async def connections():
+        return pool_stats()
+
+    @router.get("/latency")
+    async def latency():
+        return {
+            "stages": {stage: histogram.to_dict() for stage, histogram in tracker.histograms.items()},
+            "ai": {
+                "p50_s": ai_caller.latency.percentile(50),
+                "p95_s": ai_caller.latency.percentile(95),
+                "p99_s": ai_caller.latency.percentile(99),
+                "timeout_s": ai_caller.timeout(),
+                "hedge_delay_s": ai_caller.hedge_delay(),
+                "breaker": ai_caller.breaker.state,
+            },
+        }
+
+    @router.post("/users/{org_id}/{user_id}/flush")
+    async def flush_user(org_id: str, user_id: str):
+        key = (org_id, user_id)
+        pending = history_buffer.get(key) is not None
+        await history_buffer.flush(key)
+        return {"flushed": pending, "still_pending": history_buffer.get(key) is not None}
+
+    @router.delete("/users/{org_id}/{user_id}/cache")
+    async def invalidate_user(org_id: str, user_id: str):
+        key = (org_id, user_id)
+        cached = key in history_cache
+        history_cache.invalidate(key)
+        return {"invalidated": cached}
+
+    @router.get("/profile", response_class=PlainTextResponse)
+    async def profile(
+        seconds: float = Query(default=5.0, gt=0, le=60),
+        interval_ms: float = Query(default=5.0, ge=1, le=1000),
+    ):
+        # Sample the event loop thread from a worker thread while the loop
+        # keeps serving requests; output is in collapsed-stack format.
+        loop_thread = threading.get_ident()
+        samples, stacks = await asyncio.to_thread(sample_stacks, loop_thread, seconds, interval_ms / 1000)
+        lines = [f"# {samples} samples over {seconds}s"]
+        lines += [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    return router
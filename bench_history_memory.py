@@ -0,0 +1,71 @@
+"""
+Compares the memory held by cached chat histories stored as lists of
+`{"role", "content"}` dicts against the compact `ChatHistory` buffers.
+
+    python bench_history_memory.py --conversations 100000 --turns 10
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from history import ChatHistory
+
+WORDS = "the a my is what favorite color name dog city food thanks remember okay blue Sparky Lagos".split()
+
+
+def make_conversation(rng, turns):
+    messages = []
+    for index in range(turns):
+        role = "user" if index % 2 == 0 else "assistant"
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 16)))
+        messages.append({"role": role, "content": content})
+    return messages
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return cache, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=100_000)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def source():
+        # Contents are regenerated for every run so neither layout shares
+        # string objects with the other.
+        rng = random.Random(args.seed)
+        for user in range(args.conversations):
+            yield user, make_conversation(rng, args.turns)
+
+    dicts, dict_bytes = measure(lambda: {user: messages for user, messages in source()})
+    del dicts
+
+    compact, compact_bytes = measure(
+        lambda: {user: ChatHistory.from_messages(messages) for user, messages in source()}
+    )
+
+    def render():
+        for history in compact.values():
+            history.to_prompt()
+            history.to_json()
+
+    _, rendered_bytes = measure(render)
+
+    print(f"{args.conversations} conversations x {args.turns} turns")
+    print(f"  list of dicts : {dict_bytes / 2**20:8.1f} MiB")
+    print(f"  ChatHistory   : {compact_bytes / 2**20:8.1f} MiB ({compact_bytes / dict_bytes:.0%} of dicts)")
+    print(f"  + cached prompt/JSON renderings: {rendered_bytes / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
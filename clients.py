@@ -0,0 +1,41 @@
+import httpx
+
+_clients = {}
+
+
+def get_client(name: str = "default") -> httpx.AsyncClient:
+    """
+    Shared, pooled HTTP client for one outbound destination ("agent_db",
+    "ai", "webhook", ...), so connections are reused across tasks.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = httpx.AsyncClient(timeout=5.0)
+    return client
+
+
+def pool_stats() -> dict:
+    stats = {}
+    for name, client in _clients.items():
+        stats[name] = {"closed": client.is_closed}
+        # httpx doesn't expose pool metrics publicly; read them off the
+        # underlying httpcore connection pool, and degrade to just "closed"
+        # if a newer httpx/httpcore has moved them.
+        try:
+            pool = client._transport._pool
+            connections = list(pool.connections)
+            stats[name].update(
+                connections=len(connections),
+                idle=sum(1 for connection in connections if connection.is_idle()),
+                available=sum(1 for connection in connections if connection.is_available()),
+                queued_requests=sum(1 for request in pool._requests if request.is_queued()),
+            )
+        except AttributeError:
+            stats[name]["pool"] = "unavailable"
+    return stats
+
+
+async def close_all():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
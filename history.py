@@ -0,0 +1,157 @@
+import json
+import time
+from array import array
+from collections import OrderedDict
+
+ROLES = ("user", "assistant")
+ROLE_IDS = {role: index for index, role in enumerate(ROLES)}
+ROLE_LABELS = tuple(f"{role.title()}: " for role in ROLES)
+ROLE_JSON = tuple(f'{{"role": {json.dumps(role)}, "content": ' for role in ROLES)
+
+
+def document_body(messages_json: str, **fields) -> str:
+    """Serialized `{"document": {"messages": [...], **fields}}` body for agent_db."""
+    extra = f", {json.dumps(fields)[1:-1]}" if fields else ""
+    return f'{{"document": {{"messages": {messages_json}{extra}}}}}'
+
+
+class Turn:
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+class ChatHistory:
+    """
+    Compact, append-only chat history.
+
+    Roles are stored as one byte each and message contents as UTF-8 in a
+    single bytearray with an offset table, instead of one dict and one str
+    object per turn. The prompt text and JSON renderings are cached and
+    extended incrementally as turns are appended.
+    """
+
+    __slots__ = ("_roles", "_ends", "_data", "_prompt", "_prompt_turns", "_json", "_json_turns")
+
+    def __init__(self):
+        self._roles = array("B")
+        self._ends = array("L")
+        self._data = bytearray()
+        self._prompt = ""
+        self._prompt_turns = 0
+        self._json = ""
+        self._json_turns = 0
+
+    @classmethod
+    def from_messages(cls, messages):
+        history = cls()
+        for message in messages:
+            history.append(message.get("role", "user"), message.get("content", ""))
+        return history
+
+    def __len__(self):
+        return len(self._roles)
+
+    def __iter__(self):
+        for index in range(len(self._roles)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._roles)
+        start = self._ends[index - 1] if index else 0
+        return Turn(ROLES[self._roles[index]], self._data[start:self._ends[index]].decode())
+
+    def append(self, role: str, content: str):
+        if role not in ROLE_IDS:
+            raise ValueError(f"Unknown role: {role}")
+        self._roles.append(ROLE_IDS[role])
+        self._data += content.encode()
+        self._ends.append(len(self._data))
+
+    def to_messages(self):
+        return [turn.to_dict() for turn in self]
+
+    def to_prompt(self) -> str:
+        if self._prompt_turns < len(self):
+            lines = [ROLE_LABELS[self._roles[i]] + self[i].content for i in range(self._prompt_turns, len(self))]
+            self._prompt = "\n".join([self._prompt, *lines]) if self._prompt else "\n".join(lines)
+            self._prompt_turns = len(self)
+        return self._prompt
+
+    def to_json(self) -> str:
+        if self._json_turns < len(self):
+            items = [ROLE_JSON[self._roles[i]] + json.dumps(self[i].content) + "}" for i in range(self._json_turns, len(self))]
+            self._json = ", ".join([self._json, *items]) if self._json else ", ".join(items)
+            self._json_turns = len(self)
+        return f"[{self._json}]"
+
+    def release_renderings(self):
+        self._prompt, self._prompt_turns = "", 0
+        self._json, self._json_turns = "", 0
+
+    def copy(self) -> "ChatHistory":
+        history = ChatHistory()
+        history._roles = array("B", self._roles)
+        history._ends = array("L", self._ends)
+        history._data = bytearray(self._data)
+        history._prompt, history._prompt_turns = self._prompt, self._prompt_turns
+        history._json, history._json_turns = self._json, self._json_turns
+        return history
+
+
+class HistoryCache:
+    """
+    LRU cache of (ChatHistory, history document id) per user, with a TTL.
+
+    Cached histories drop their prompt/JSON strings by default: keeping
+    them roughly doubles each entry, which outweighs re-rendering the one
+    history a turn touches. Readers get their own copy from `get`.
+
+    Entries are not validated against agent_db, so the cache is only
+    correct when one process serves all of a user's turns. `max_entries=0`
+    disables it.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0, keep_renderings: bool = False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.keep_renderings = keep_renderings
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1].copy(), entry[2]
+
+    def put(self, key, history: ChatHistory, history_id):
+        if self.max_entries <= 0:
+            return
+        if not self.keep_renderings:
+            history.release_renderings()
+        self._entries[key] = (time.monotonic(), history, history_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
@@ -1,13 +1,19 @@
-import os, random, httpx, requests
+import os, time, httpx
 from pprint import pprint
-import uvicorn, json
+import json
 import schemas
+from resilience import CircuitBreaker, ResilientCaller
+from ratelimit import FairScheduler, InMemoryBackend, RateLimiter
+from history import ChatHistory, HistoryCache, document_body
+from writebehind import WriteBehindBuffer
+from clients import close_all, get_client
+from monitoring import TaskTracker
+from providers import LocalProvider, MicroBatcher, TelexProvider
 from uuid import uuid4
-from fastapi import FastAPI, Request, status, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, status, HTTPException
 from fastapi.responses import HTMLResponse
-from a2a.utils import new_agent_text_message
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 # Load environment variables from .env file
 
 load_dotenv()
@@ -17,10 +23,101 @@ TELEX_API_URL = os.getenv('TELEX_API_URL')
 TELEX_AI_URL = os.getenv('TELEX_AI_URL')
 TELEX_AI_MODEL = os.getenv('TELEX_AI_MODEL')
 
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY')
+
 PORT = int(os.getenv("PORT", 4000))
 
 app = FastAPI()
 
+def is_upstream_failure(error):
+  # a 4xx means this tenant's request was rejected (e.g. a bad api key), not that the AI
+  # service is unhealthy, so it must not open the breaker for every other tenant
+  if isinstance(error, httpx.HTTPStatusError):
+    return error.response.status_code >= 500 or error.response.status_code == 429
+  return True
+
+ai_caller = ResilientCaller(
+  min_timeout=float(os.getenv("AI_MIN_TIMEOUT", 2.0)),
+  max_timeout=float(os.getenv("AI_MAX_TIMEOUT", 15.0)),
+  hedge_percentile=float(os.getenv("AI_HEDGE_PERCENTILE", 95)),
+  max_concurrency_per_key=int(os.getenv("AI_MAX_CONCURRENCY_PER_KEY", 4)),
+  breaker=CircuitBreaker(
+    failure_threshold=int(os.getenv("AI_BREAKER_FAILURES", 5)),
+    reset_timeout=float(os.getenv("AI_BREAKER_RESET", 30.0)),
+  ),
+  is_failure=is_upstream_failure,
+)
+
+rate_limiter = RateLimiter(
+  backend=InMemoryBackend(max_buckets=int(os.getenv("RATE_LIMIT_MAX_BUCKETS", 100000))),
+  org_rate=float(os.getenv("ORG_RATE_LIMIT", 5.0)),
+  org_burst=float(os.getenv("ORG_RATE_BURST", 20.0)),
+  key_rate=float(os.getenv("API_KEY_RATE_LIMIT", 2.0)),
+  key_burst=float(os.getenv("API_KEY_RATE_BURST", 10.0)),
+)
+
+task_scheduler = FairScheduler(
+  concurrency=int(os.getenv("TASK_CONCURRENCY", 8)),
+  weights=json.loads(os.getenv("ORG_WEIGHTS", "{}")),
+)
+
+task_tracker = TaskTracker()
+
+# The history cache and the write-behind buffer below are per process, with no
+# coherence between workers: a user whose turns land on two workers would read
+# a stale history and the next PUT would drop the other worker's turns. The
+# cache is therefore off unless HISTORY_CACHE_SIZE is set, which is only safe
+# with a single worker (or sticky routing of users to workers).
+history_cache = HistoryCache(
+  max_entries=int(os.getenv("HISTORY_CACHE_SIZE", 0)),
+  ttl=float(os.getenv("HISTORY_CACHE_TTL", 60)),
+  keep_renderings=os.getenv("HISTORY_CACHE_RENDERINGS", "0") == "1",
+)
+
+def days_from_env(name):
+  value = os.getenv(name)
+  return timedelta(days=float(value)) if value else None
+
+# the maintenance job is only loaded when at least one retention policy is configured
+memory_maintenance = None
+if any(os.getenv(name) for name in ("FACT_TTL_DAYS", "HISTORY_ARCHIVE_DAYS", "HISTORY_ARCHIVE_TTL_DAYS", "HISTORY_MAX_MESSAGES")):
+  from maintenance import MemoryMaintenance
+
+  memory_maintenance = MemoryMaintenance(
+    base_url=TELEX_API_URL,
+    interval=float(os.getenv("MEMORY_GC_INTERVAL", 3600)),
+    fact_ttl=days_from_env("FACT_TTL_DAYS"),
+    history_archive_after=days_from_env("HISTORY_ARCHIVE_DAYS"),
+    archive_ttl=days_from_env("HISTORY_ARCHIVE_TTL_DAYS"),
+    history_max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", 0)) or None,
+  )
+
+local_classifier = LocalProvider()
+
+DEGRADED_INTENT = {
+  "intent": "chat",
+  "data": {
+    "key": "reply",
+    "value": "I'm having a little trouble right now and can't save that. Please tell me again in a moment."
+  }
+}
+
+if os.getenv("LLM_PROVIDER", "telex") == "local":
+  llm_provider = local_classifier
+else:
+  llm_provider = TelexProvider(
+    url=TELEX_AI_URL,
+    model=TELEX_AI_MODEL or "openai/gpt-4.1",
+    organisation_id=os.getenv("TELEX_AI_ORG_ID", "01971783-a2ff-78b2-bd02-d9ddf8fb23c6"),
+    batch=os.getenv("TELEX_AI_BATCH", "0") == "1",
+  )
+
+llm_batcher = MicroBatcher(
+  llm_provider,
+  window=float(os.getenv("LLM_BATCH_WINDOW_MS", 5)) / 1000,
+  max_batch=int(os.getenv("LLM_BATCH_SIZE", 16)),
+)
+
 RAW_AGENT_CARD_DATA = {
   "name": "Conversational Memory Agent",
   "description": "An agent that can remember and recall information using a database and understand user intent with the AI.",
@@ -74,6 +171,26 @@ RAW_AGENT_CARD_DATA = {
 }
 
 
+@app.on_event("startup")
+async def start_maintenance():
+  if memory_maintenance:
+    memory_maintenance.start()
+
+
+@app.on_event("startup")
+async def replay_history_journal():
+  await history_buffer.replay()
+
+
+@app.on_event("shutdown")
+async def flush_history_buffer():
+  # let running turns finish writing their history before the final flush
+  await task_scheduler.drain(timeout=float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 20)))
+  await history_buffer.flush_all()
+  await history_buffer.close()
+  await close_all()
+
+
 @app.get("/", response_class=HTMLResponse)
 def read_root():
     return '<p style="font-size:30px">AI Agent</p>'
@@ -92,9 +209,9 @@ def agent_card(request: Request):
 
     return response_agent_card
 
-async def analyze_intent_with_ai(chat_history, api_key):
+async def analyze_intent_with_ai(chat_history: ChatHistory, api_key, org_id, user_id):
 
-    formatted_chat_history = "\n".join([f"{msg['role'].title()}: {msg['content']}" for msg in chat_history])
+    formatted_chat_history = chat_history.to_prompt()
       
     """
     Uses AI to analyze the user's message to determine intent.
@@ -146,40 +263,29 @@ async def analyze_intent_with_ai(chat_history, api_key):
     {formatted_chat_history}
     """
 
+    reply = None
     try:
-      async with httpx.AsyncClient(timeout=5.0) as client:
-        request_headers = {
-          "X-AGENT-API-KEY": api_key,
-          "X-MODEL": TELEX_AI_MODEL
-        }
-        print(f"Request headers: {request_headers}")
-
-        request_body = {
-          "organisation_id": "01971783-a2ff-78b2-bd02-d9ddf8fb23c6",
-          "model": "openai/gpt-4.1",
-          "messages": [
-            {
-              "role": "system",
-              "content": prompt
-            }
-          ],
-          "stream": False
+      messages = [
+        {
+          "role": "system",
+          "content": prompt
         }
+      ]
 
-        response = await client.post(
-          TELEX_AI_URL, 
-          headers=request_headers,
-          json=request_body,
-          timeout=15.0
-        )
+      async def request_ai(timeout):
+        return await llm_batcher.complete(messages, api_key, timeout, scope=(org_id, user_id))
 
-        pprint(response.json())
-        response.raise_for_status()
-        # Extract the JSON string from the AI's response
-        res = response.json().get("data", {}).get("Messages", None)
-        reply = res.get("content", "not available")
-        
-        return json.loads(reply)
+      reply = await ai_caller.call(api_key, request_ai, lambda: None)
+
+      if reply is None:
+        # degraded mode: classify the last message locally instead of failing the turn, but
+        # only answer from memory; regex guesses must never be stored as facts
+        intent = local_classifier.classify(chat_history[-1].content)
+        if intent["intent"] not in ("recall", "chat"):
+          return DEGRADED_INTENT
+        return intent
+
+      return json.loads(reply)
 
     except (KeyError, IndexError, json.JSONDecodeError) as e:
         print(f"Error parsing AI response: {e}")
@@ -199,22 +305,22 @@ async def res_based_on_intent(payload, user_id, org_id, api_key):
         response_message = "I think you want me to remember something, but I couldn't figure out what."
 
     else:
-      async with httpx.AsyncClient() as client:
-        headers = {"X-AGENT-API-KEY": api_key}
-        body = {
-          "document": {
-            "type": "user_information",
-            "user_id": user_id,
-            "key": key,
-            "value": value,
-            "created_at": datetime.now().isoformat(),
-          }
+      client = get_client("agent_db")
+      headers = {"X-AGENT-API-KEY": api_key}
+      body = {
+        "document": {
+          "type": "user_information",
+          "user_id": user_id,
+          "key": key,
+          "value": value,
+          "created_at": datetime.now().isoformat(),
         }
-        is_sent = await client.post(f"{TELEX_API_URL}/agent_db/collections/user_information/documents", headers=headers, json=body)
-        pprint(is_sent.json())
+      }
+      is_sent = await client.post(f"{TELEX_API_URL}/agent_db/collections/user_information/documents", headers=headers, json=body)
+      pprint(is_sent.json())
 
-        is_sent.raise_for_status()
-        response_message = f"Okay, I'll remember that your {key} is {value}."
+      is_sent.raise_for_status()
+      response_message = f"Okay, I'll remember that your {key} is {value}."
 
   elif intent == "recall":
     key = data.get("key")
@@ -225,38 +331,36 @@ async def res_based_on_intent(payload, user_id, org_id, api_key):
     else:
       # Find the user's memory document
       user_memory = None
-      async with httpx.AsyncClient() as client:
-        headers = {"X-AGENT-API-KEY": api_key}
-        data = { 
-          "filter": {
-            "type": "user_information", 
-            "user_id": user_id,
-            "key": key,
-            "organisation_id": org_id
-          }
+      client = get_client("agent_db")
+      headers = {"X-AGENT-API-KEY": api_key}
+      data = { 
+        "filter": {
+          "type": "user_information", 
+          "user_id": user_id,
+          "key": key,
+          "organisation_id": org_id
         }
-        response = requests.get(
-          url=f"{TELEX_API_URL}/agent_db/collections/user_information/documents", 
-          headers=headers, 
-          json=data
-        )
-        # user_memory = await client.get(
-        #   f"{TELEX_API_URL}/agent_db/collections/user_information/documents", 
-        #   headers=headers, 
-        #   content=filter
-        # )
-
-        pprint(response.json())
-        response.raise_for_status()
-        user_memory = response.json().get("data", [])
+      }
+      # httpx only accepts a JSON body on GET through the generic request()
+      response = await client.request(
+        "GET",
+        f"{TELEX_API_URL}/agent_db/collections/user_information/documents", 
+        headers=headers, 
+        json=data
+      )
+
+      pprint(response.json())
+      response.raise_for_status()
+      user_memory = response.json().get("data", [])
 
-        match = list(filter(lambda doc: doc.get("key") == key, user_memory))
+      match = list(filter(lambda doc: doc.get("key") == key, user_memory))
 
-        if match:
-          recalled_value = match[0]["value"]
-          response_message = f"You told me your {key} is {recalled_value}."
-        else:
-            response_message = f"I don't think you've told me your {key} yet."
+      if match:
+        # duplicates are only collapsed by the maintenance job, so prefer the newest fact
+        recalled_value = max(match, key=lambda doc: doc.get("created_at", ""))["value"]
+        response_message = f"You told me your {key} is {recalled_value}."
+      else:
+          response_message = f"I don't think you've told me your {key} yet."
 
   elif intent == "chat":
     response_message = data.get("value", "I'm not sure how to respond to that.")
@@ -268,11 +372,17 @@ async def res_based_on_intent(payload, user_id, org_id, api_key):
 
 
 async def retrieve_chat_history(user_message, user_id, org_id, api_key):
-   #retrieve chat history from the database
-    chat_history = None
-    chat_history_id = None
+   #retrieve chat history from unflushed writes or the cache, falling back to the database
+    # both return a private copy, so concurrent turns for one user can't interleave
+    # their messages and a failed turn can't leave a dangling one behind
+    pending = history_buffer.get((org_id, user_id))
+    cached = (pending.history.copy(), pending.history_id) if pending else history_cache.get((org_id, user_id))
 
-    async with httpx.AsyncClient() as client:
+    if cached:
+      chat_history, chat_history_id = cached
+
+    else:
+      client = get_client("agent_db")
       headers = {"X-AGENT-API-KEY": api_key}
       data = { 
         "filter": {
@@ -281,8 +391,9 @@ async def retrieve_chat_history(user_message, user_id, org_id, api_key):
           "organisation_id": org_id
         }
       }
-      response = requests.get(
-        url=f"{TELEX_API_URL}/agent_db/collections/user_information/documents", 
+      response = await client.request(
+        "GET",
+        f"{TELEX_API_URL}/agent_db/collections/user_information/documents", 
         headers=headers, 
         json=data
       )
@@ -292,72 +403,97 @@ async def retrieve_chat_history(user_message, user_id, org_id, api_key):
       if response.status_code not in [200, 404]:
         response.raise_for_status()
 
-      chat_history = response.json().get("data", [])
-      chat_history_id = chat_history[0].get("_id") if chat_history else None
-    
-    chat_history = chat_history[0].get("messages", []) if chat_history else []
-    chat_history.append({
-      "role": "user",
-      "content": user_message
-    })
+      documents = response.json().get("data", [])
+      chat_history_id = documents[0].get("_id") if documents else None
+
+      chat_history = ChatHistory.from_messages(documents[0].get("messages", []) if documents else [])
+
+    chat_history.append("user", user_message)
 
     return chat_history, chat_history_id
 
 
+async def persist_history(entry):
+  started = time.monotonic()
+  #update or create if not exists
+  client = get_client("agent_db")
+  headers = {"X-AGENT-API-KEY": entry.api_key, "Content-Type": "application/json"}
+  history_id = entry.history_id
+  if history_id:
+    body = document_body(entry.messages_json, updated_at=datetime.now().isoformat())
+    db_history = await client.put(f"{TELEX_API_URL}/agent_db/collections/user_information/documents/{history_id}", headers=headers, content=body)
+    pprint(db_history.json())
+
+  else:
+    body = document_body(
+      entry.messages_json,
+      type="user_history",
+      user_id=entry.user_id,
+      created_at=datetime.now().isoformat(),
+      updated_at=datetime.now().isoformat(),
+    )
+    db_history = await client.post(f"{TELEX_API_URL}/agent_db/collections/user_information/documents", headers=headers, content=body)
+    pprint(db_history.json())
+
+    created = db_history.json().get("data")
+    if isinstance(created, dict):
+      history_id = created.get("_id") or created.get("id")
+
+  db_history.raise_for_status()
+  task_tracker.observe("history_flush", (time.monotonic() - started) * 1000)
+
+  return history_id
+
+
+def cache_flushed_history(entry):
+  if entry.history_id:
+    history_cache.put(entry.key, entry.history, entry.history_id)
+  else:
+    history_cache.invalidate(entry.key)
+
+
+history_buffer = WriteBehindBuffer(
+  persist_history,
+  # each worker journals into its own subdirectory and adopts those of dead workers
+  journal_dir=os.getenv("HISTORY_JOURNAL_DIR", "history_journal") or None,
+  flush_delay=float(os.getenv("HISTORY_FLUSH_DELAY", 1.0)),
+  fsync=os.getenv("HISTORY_JOURNAL_FSYNC", "0") == "1",
+  on_flushed=cache_flushed_history,
+)
+
+
 async def handle_task(message:str, request_id, user_id:str, task_id: str, webhook_url: str, org_id: str, api_key: str):
 
   #attempt to create mongodb collection
-  async with httpx.AsyncClient() as client:
-    headers = {"X-AGENT-API-KEY": api_key}
-    body = {
-      "collection": "user_information"
-    }
-    is_created = await client.post(f"{TELEX_API_URL}/agent_db/collections", headers=headers, json=body)
-    pprint(is_created.json())
-
-    if is_created.status_code not in [200, 400]:
-      raise HTTPException(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        detail="Failed to create or access the user information collection."
-      )
+  task_tracker.enter(task_id, "collection")
+  client = get_client("agent_db")
+  headers = {"X-AGENT-API-KEY": api_key}
+  body = {
+    "collection": "user_information"
+  }
+  is_created = await client.post(f"{TELEX_API_URL}/agent_db/collections", headers=headers, json=body)
+  pprint(is_created.json())
+
+  if is_created.status_code not in [200, 400]:
+    raise HTTPException(
+      status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+      detail="Failed to create or access the user information collection."
+    )
     
 
+  task_tracker.enter(task_id, "history")
   chat_history, chat_history_id = await retrieve_chat_history(user_message=message, user_id=user_id, org_id=org_id, api_key=api_key)
 
-  intent = await analyze_intent_with_ai(chat_history, api_key)
+  task_tracker.enter(task_id, "classify")
+  intent = await analyze_intent_with_ai(chat_history, api_key, org_id, user_id)
 
+  task_tracker.enter(task_id, "act")
   response = await res_based_on_intent(intent, user_id, org_id, api_key)
 
-  chat_history.append({
-     "role": "assistant",
-     "content": response
-  })
+  chat_history.append("assistant", response)
 
-  #update or create if not exists
-  async with httpx.AsyncClient() as client:
-    headers = {"X-AGENT-API-KEY": api_key}
-    body = {
-      "document": {
-        "messages": chat_history
-      }
-    }
-    if chat_history_id:
-      db_history = await client.put(f"{TELEX_API_URL}/agent_db/collections/user_information/documents/{chat_history_id}", headers=headers, json=body)
-      pprint(db_history.json())
-
-    else:
-      body = {
-        "document": {
-          "type": "user_history",
-          "user_id": user_id,
-          "messages": chat_history,
-          "created_at": datetime.now().isoformat(),
-        }
-      }
-      db_history = await client.post(f"{TELEX_API_URL}/agent_db/collections/user_information/documents", headers=headers, json=body)
-      pprint(db_history.json())
-
-    db_history.raise_for_status()
+  # persisted asynchronously; the reply doesn't wait on agent_db
+  await history_buffer.write((org_id, user_id), chat_history, chat_history_id, api_key, user_id, org_id)
 
   parts = schemas.TextPart(text=response)
 
@@ -369,7 +505,7 @@ async def handle_task(message:str, request_id, user_id:str, task_id: str, webhoo
     id = task_id,
     status =  schemas.TaskStatus(
       state=schemas.TaskState.COMPLETED, 
-      message=schemas.Message(role="agent", parts=[schemas.TextPart(text=response)])
+      message=message
     ),
     artifacts = [artifacts]
   )
@@ -379,21 +515,28 @@ async def handle_task(message:str, request_id, user_id:str, task_id: str, webhoo
       result=task
   )
 
-  pprint(webhook_response.model_dump())
+  webhook_payload = webhook_response.model_dump(exclude_none=True)
+  pprint(webhook_payload)
 
 
-  async with httpx.AsyncClient() as client:
-    headers = {"X-TELEX-API-KEY": api_key}
-    is_sent = await client.post(webhook_url, headers=headers,  json=webhook_response.model_dump(exclude_none=True))
-    pprint(is_sent.json())
+  task_tracker.enter(task_id, "webhook")
+  client = get_client("webhook")
+  headers = {"X-TELEX-API-KEY": api_key}
+  is_sent = await client.post(webhook_url, headers=headers,  json=webhook_payload)
+  pprint(is_sent.json())
 
   print("background done")
   return 
 
 
+async def handle_tracked_task(message:str, request_id, user_id:str, task_id: str, webhook_url: str, org_id: str, api_key: str):
+  with task_tracker.track(task_id):
+    await handle_task(message, request_id, user_id, task_id, webhook_url, org_id, api_key)
+
+
 
 @app.post("/")
-async def handle_request(request: Request, background_tasks: BackgroundTasks):
+async def handle_request(request: Request):
   try:
     body = await request.json()
 
@@ -418,6 +561,20 @@ async def handle_request(request: Request, background_tasks: BackgroundTasks):
       status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
       detail="Message cannot be empty."
     )
+
+  breached, retry_after = await rate_limiter.check(org_id, api_key)
+  if breached:
+    response = schemas.JSONRPCResponse(
+      id=request_id,
+      error=schemas.RateLimitExceededError(
+        data={"limit": breached, "retry_after": round(retry_after, 3)}
+      )
+    )
+    return response.model_dump(exclude_none=True)
+
+  if memory_maintenance:
+    memory_maintenance.register(api_key)
+  history_buffer.supply_key(api_key)
   
   new_task = schemas.Task(
     id = uuid4().hex,
@@ -427,7 +584,8 @@ async def handle_request(request: Request, background_tasks: BackgroundTasks):
     )
   )
   
-  background_tasks.add_task(handle_task, message, request_id, user_id, new_task.id, webhook_url, org_id, api_key)
+  task_tracker.queued(new_task.id, org_id, user_id)
+  task_scheduler.submit(org_id, handle_tracked_task, message, request_id, user_id, new_task.id, webhook_url, org_id, api_key)
 
   response = schemas.JSONRPCResponse(
       id=request_id,
@@ -451,6 +609,22 @@ async def handle_request(request: Request, background_tasks: BackgroundTasks):
   return response
 
 
+if ADMIN_API_KEY:
+  from admin import build_admin_router
+
+  app.include_router(build_admin_router(
+    ADMIN_API_KEY,
+    tracker=task_tracker,
+    scheduler=task_scheduler,
+    history_cache=history_cache,
+    history_buffer=history_buffer,
+    ai_caller=ai_caller,
+    rate_limiter=rate_limiter,
+  ))
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv("PORT", 10000))
     uvicorn.run("main:app", host="127.0.0.1", port=PORT, reload=True)
@@ -0,0 +1,235 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+
+from clients import get_client
+
+COLLECTION = "user_information"
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MemoryMaintenance:
+    """
+    Periodic garbage collection of the agent_db memory collection.
+
+    Each run, for every API key that has been active recently:
+    - collapses duplicate fact keys per user to the most recent value,
+    - expires facts older than `fact_ttl`,
+    - archives histories idle for longer than `history_archive_after`,
+    - splits the older messages of histories longer than
+      `history_max_messages` into `user_history_archive` documents, keeping
+      a bounded tail so active users' prompts stop growing,
+    - expires archived histories older than `archive_ttl`.
+
+    Deletes and archives go through the per-document endpoints the agent
+    already uses (`documents/{id}`), issued `concurrency` at a time.
+    Facts without a readable `created_at` are never expired or collapsed.
+
+    agent_db has no conditional writes, so trimming a history races with the
+    agent's own read-append-PUT of it. Histories updated within
+    `quiet_period` are left alone; the archive is written before the trimmed
+    tail, so a lost race can only leave messages in both places.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        interval: float = 3600,
+        fact_ttl: timedelta | None = None,
+        history_archive_after: timedelta | None = None,
+        archive_ttl: timedelta | None = None,
+        history_max_messages: int | None = None,
+        quiet_period: timedelta = timedelta(minutes=10),
+        concurrency: int = 10,
+    ):
+        self.base_url = base_url
+        self.interval = interval
+        self.fact_ttl = fact_ttl
+        self.history_archive_after = history_archive_after
+        self.archive_ttl = archive_ttl
+        self.history_max_messages = history_max_messages
+        self.quiet_period = quiet_period
+        self.concurrency = concurrency
+        self.api_keys = {}
+        self._task = None
+
+    def register(self, api_key):
+        if api_key:
+            self.api_keys[api_key] = datetime.now()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception as e:
+                print(f"Memory maintenance failed: {e!r}")
+
+    async def run(self) -> dict:
+        now = datetime.now()
+        report = {
+            "facts_deduplicated": 0,
+            "facts_expired": 0,
+            "histories_archived": 0,
+            "history_segments_archived": 0,
+            "archives_expired": 0,
+            "keys_failed": 0,
+            "keys_dropped": 0,
+        }
+
+        # Keys that haven't been seen for longer than any TTL have nothing
+        # left for us to reclaim once their last run has completed.
+        horizon = max(
+            [ttl for ttl in (self.fact_ttl, self.history_archive_after, self.archive_ttl) if ttl],
+            default=timedelta(0),
+        )
+
+        client = get_client("agent_db")
+        for api_key, last_seen in list(self.api_keys.items()):
+            try:
+                counts = await self._run_for_key(client, api_key, now)
+            except httpx.HTTPStatusError as e:
+                report["keys_failed"] += 1
+                if e.response.status_code in (401, 403):
+                    # revoked or bogus credentials will never succeed; stop retrying them
+                    del self.api_keys[api_key]
+                    report["keys_dropped"] += 1
+                continue
+            except Exception as e:
+                print(f"Memory maintenance failed for a key: {e!r}")
+                report["keys_failed"] += 1
+                continue
+
+            for name, count in counts.items():
+                report[name] += count
+            if now - last_seen > horizon + timedelta(seconds=self.interval):
+                del self.api_keys[api_key]
+
+        report["reclaimed"] = (
+            report["facts_deduplicated"] + report["facts_expired"] + report["archives_expired"]
+        )
+        print(f"Memory maintenance: {report}")
+        return report
+
+    async def _gather(self, calls):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(call):
+            async with semaphore:
+                await call
+
+        await asyncio.gather(*[limited(call) for call in calls])
+
+    async def _fetch(self, client, headers, doc_type):
+        response = await client.request(
+            "GET",
+            f"{self.base_url}/agent_db/collections/{COLLECTION}/documents",
+            headers=headers,
+            json={"filter": {"type": doc_type}},
+        )
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        return response.json().get("data", []) or []
+
+    async def _run_for_key(self, client, api_key, now):
+        headers = {"X-AGENT-API-KEY": api_key}
+        facts = await self._fetch(client, headers, "user_information")
+        histories = await self._fetch(client, headers, "user_history")
+        archives = await self._fetch(client, headers, "user_history_archive")
+
+        duplicate_ids, expired_fact_ids = [], []
+        latest = {}
+        for doc in facts:
+            created_at = _parse_time(doc.get("created_at"))
+            if created_at is None:
+                continue
+            if self.fact_ttl and now - created_at > self.fact_ttl:
+                expired_fact_ids.append(doc["_id"])
+                continue
+
+            group = (doc.get("user_id"), doc.get("key"))
+            if group in latest:
+                kept_at, kept_id = latest[group]
+                if created_at > kept_at:
+                    duplicate_ids.append(kept_id)
+                    latest[group] = (created_at, doc["_id"])
+                else:
+                    duplicate_ids.append(doc["_id"])
+            else:
+                latest[group] = (created_at, doc["_id"])
+
+        archive_ids, split_docs = [], []
+        for doc in histories:
+            active_at = _parse_time(doc.get("updated_at") or doc.get("created_at"))
+            if active_at is None:
+                continue
+            if self.history_archive_after and now - active_at > self.history_archive_after:
+                archive_ids.append(doc["_id"])
+            elif (
+                self.history_max_messages
+                and len(doc.get("messages") or []) > self.history_max_messages
+                and now - active_at > self.quiet_period
+            ):
+                split_docs.append(doc)
+
+        expired_archive_ids = []
+        if self.archive_ttl:
+            for doc in archives:
+                archived_at = _parse_time(doc.get("archived_at"))
+                if archived_at and now - archived_at > self.archive_ttl:
+                    expired_archive_ids.append(doc["_id"])
+
+        documents_url = f"{self.base_url}/agent_db/collections/{COLLECTION}/documents"
+        archived = {"document": {"type": "user_history_archive", "archived_at": now.isoformat()}}
+
+        async def delete(doc_id):
+            response = await client.delete(f"{documents_url}/{doc_id}", headers=headers)
+            if response.status_code != 404:
+                response.raise_for_status()
+
+        async def archive(doc_id):
+            # Archived histories drop out of the `user_history` lookups, so the
+            # user's next message starts a fresh, small history document.
+            response = await client.put(f"{documents_url}/{doc_id}", headers=headers, json=archived)
+            response.raise_for_status()
+
+        await self._gather([delete(doc_id) for doc_id in duplicate_ids + expired_fact_ids + expired_archive_ids])
+        async def split(doc):
+            messages = doc["messages"]
+            cut = len(messages) - self.history_max_messages
+            segment = {"document": {
+                "type": "user_history_archive",
+                "user_id": doc.get("user_id"),
+                "history_id": doc["_id"],
+                "messages": messages[:cut],
+                "archived_at": now.isoformat(),
+            }}
+            response = await client.post(documents_url, headers=headers, json=segment)
+            response.raise_for_status()
+            response = await client.put(
+                f"{documents_url}/{doc['_id']}", headers=headers, json={"document": {"messages": messages[cut:]}}
+            )
+            response.raise_for_status()
+
+        await self._gather([archive(doc_id) for doc_id in archive_ids])
+        await self._gather([split(doc) for doc in split_docs])
+
+        return {
+            "facts_deduplicated": len(duplicate_ids),
+            "facts_expired": len(expired_fact_ids),
+            "histories_archived": len(archive_ids),
+            "history_segments_archived": len(split_docs),
+            "archives_expired": len(expired_archive_ids),
+        }
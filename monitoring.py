@@ -0,0 +1,113 @@
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds in milliseconds; the last bucket catches everything slower.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total_ms")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "buckets": {
+                ("+Inf" if bound == float("inf") else f"le_{bound}"): count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)
+            },
+        }
+
+
+class TaskTracker:
+    """
+    Keeps the stage of every queued and in-flight task, and per-stage
+    latency histograms of the ones that have passed through.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.histograms = {}
+
+    def queued(self, task_id, org_id, user_id):
+        now = time.monotonic()
+        self.tasks[task_id] = {"org_id": org_id, "user_id": user_id, "stage": "queued", "created_at": now, "stage_at": now}
+
+    def observe(self, stage, ms):
+        if stage not in self.histograms:
+            self.histograms[stage] = LatencyHistogram()
+        self.histograms[stage].observe(ms)
+
+    def enter(self, task_id, stage):
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        now = time.monotonic()
+        self.observe(task["stage"], (now - task["stage_at"]) * 1000)
+        task["stage"], task["stage_at"] = stage, now
+
+    def finish(self, task_id):
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            return
+        now = time.monotonic()
+        self.observe(task["stage"], (now - task["stage_at"]) * 1000)
+        self.observe("total", (now - task["created_at"]) * 1000)
+
+    @contextmanager
+    def track(self, task_id):
+        try:
+            yield
+        finally:
+            self.finish(task_id)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [
+            {
+                "task_id": task_id,
+                "org_id": task["org_id"],
+                "user_id": task["user_id"],
+                "stage": task["stage"],
+                "age_ms": round((now - task["created_at"]) * 1000, 1),
+                "stage_age_ms": round((now - task["stage_at"]) * 1000, 1),
+            }
+            for task_id, task in self.tasks.items()
+        ]
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> tuple[int, Counter]:
+    """
+    Samples the Python stack of `thread_id` every `interval` seconds for
+    `seconds`, from the calling thread. Stacks are collapsed root-first into
+    `file:function:line;...` strings, the input format of flamegraph tools.
+    """
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        stacks[";".join(reversed(frames))] += 1
+        samples += 1
+        time.sleep(interval)
+    return samples, stacks
@@ -0,0 +1,79 @@
+"""
+Measures the cold-start import cost of the agent.
+
+Imports `main` in fresh interpreters with `-X importtime`, reports the
+median import time and the most expensive modules it imports directly,
+and exits non-zero when the median exceeds the budget.
+
+    python profile_imports.py --budget 1500 --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 1500))
+
+
+def measure(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr}")
+
+    # Lines come out children first, each nested import indented two more
+    # spaces than the module that triggered it. Interpreter startup modules
+    # (site, encodings, ...) are top-level lines of their own and are left out.
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        cumulative_us = cumulative_us.strip()
+        if not cumulative_us.isdigit():
+            continue
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative_us)
+        elif depth == 0:
+            if name == module:
+                return int(cumulative_us) / 1000, children
+            children = {}
+    sys.exit(f"No import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS, help="median budget in milliseconds")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    timings = []
+    heaviest = {}
+    for _ in range(args.runs):
+        total_ms, children = measure(args.module)
+        timings.append(total_ms)
+        for name, cumulative_us in children.items():
+            heaviest[name] = max(heaviest.get(name, 0), cumulative_us)
+
+    median_ms = statistics.median(timings)
+    print(f"Cold start importing '{args.module}': median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(timings):.1f} ms, max {max(timings):.1f} ms), budget {args.budget:.0f} ms")
+    print(f"Heaviest imports made by '{args.module}':")
+    for name, cumulative_us in sorted(heaviest.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if median_ms > args.budget:
+        sys.exit(f"Import budget exceeded by {median_ms - args.budget:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import re
+from abc import ABC, abstractmethod
+from pprint import pprint
+
+from clients import get_client
+
+
+class LLMProvider(ABC):
+    """
+    A chat completion backend. `complete` takes OpenAI-style messages and
+    returns the text of the model's reply. Providers that can serve several
+    independent requests in one call set `supports_batch` and override
+    `complete_batch`.
+    """
+
+    supports_batch = False
+
+    @abstractmethod
+    async def complete(self, messages: list[dict], api_key: str, timeout: float) -> str:
+        ...
+
+    async def complete_batch(self, batch: list[list[dict]], api_key: str, timeout: float) -> list[str]:
+        return list(await asyncio.gather(*[self.complete(messages, api_key, timeout) for messages in batch]))
+
+
+class TelexProvider(LLMProvider):
+    """
+    Telex AI chat completions. With `batch` on, coalesced requests are sent
+    as one completion that carries every conversation and asks for a JSON
+    array with one reply per conversation, in order. A batch whose reply
+    can't be matched up falls back to individual calls. The conversations
+    share one context window, so only batch requests from the same end user
+    (MicroBatcher's `scope`).
+    """
+
+    BATCH_INSTRUCTIONS = (
+        "You will receive {count} independent tasks, each between <task n> and </task n> markers. "
+        "Complete each task on its own, exactly as instructed inside it. "
+        "Your response MUST be a single JSON array with exactly {count} elements, where element n "
+        "is the JSON output requested by task n. Do not add any other text."
+    )
+
+    def __init__(self, url: str, model: str, organisation_id: str, batch: bool = False):
+        self.url = url
+        self.model = model
+        self.organisation_id = organisation_id
+        self.supports_batch = batch
+
+    async def complete(self, messages, api_key, timeout):
+        client = get_client("ai")
+        request_headers = {
+            "X-AGENT-API-KEY": api_key,
+            "X-MODEL": self.model
+        }
+        request_body = {
+            "organisation_id": self.organisation_id,
+            "model": self.model,
+            "messages": messages,
+            "stream": False
+        }
+
+        response = await client.post(self.url, headers=request_headers, json=request_body, timeout=timeout)
+
+        pprint(response.json())
+        response.raise_for_status()
+        # Extract the JSON string from the AI's response
+        res = response.json().get("data", {}).get("Messages", None)
+        return res.get("content", "not available")
+
+    async def complete_batch(self, batch, api_key, timeout):
+        if len(batch) == 1:
+            return [await self.complete(batch[0], api_key, timeout)]
+
+        tasks = "\n\n".join(
+            f"<task {n}>\n" + "\n".join(message["content"] for message in messages) + f"\n</task {n}>"
+            for n, messages in enumerate(batch, start=1)
+        )
+        messages = [
+            {"role": "system", "content": self.BATCH_INSTRUCTIONS.format(count=len(batch))},
+            {"role": "user", "content": tasks},
+        ]
+        reply = await self.complete(messages, api_key, timeout)
+
+        try:
+            replies = json.loads(reply)
+        except json.JSONDecodeError:
+            replies = None
+        if not isinstance(replies, list) or len(replies) != len(batch):
+            print(f"Batched reply didn't match {len(batch)} tasks, retrying individually")
+            return await super().complete_batch(batch, api_key, timeout)
+
+        return [json.dumps(item) if not isinstance(item, str) else item for item in replies]
+
+
+class LocalProvider(LLMProvider):
+    """
+    Deterministic rule-based stand-in for the intent classifier, for tests,
+    benchmarks and as a degraded fallback. It reads the last user line of the
+    conversation history embedded in the prompt and answers in the same JSON
+    format the classifier prompt asks the model for.
+    """
+
+    supports_batch = True
+
+    REMEMBER = re.compile(r"^(?:remember(?: that)?\s+)?my (?P<key>.+?) (?:is|are) (?P<value>.+?)[.!]?$", re.I)
+    RECALL = re.compile(r"^(?:what|who|where|when)(?:'s| is| are) my (?P<key>.+?)\??$", re.I)
+
+    def classify(self, message: str) -> dict:
+        message = message.strip()
+        if match := self.RECALL.match(message):
+            return {"intent": "recall", "data": {"key": match["key"].lower()}}
+        if match := self.REMEMBER.match(message):
+            return {"intent": "remember", "data": {"key": match["key"].lower(), "value": match["value"]}}
+        return {"intent": "chat", "data": {"key": "reply", "value": "Got it. Is there anything you'd like me to remember?"}}
+
+    @staticmethod
+    def last_user_message(messages):
+        text = messages[-1]["content"] if messages else ""
+        lines = [line.strip() for line in text.splitlines() if line.strip().startswith("User:")]
+        return lines[-1][len("User:"):] if lines else text
+
+    async def complete(self, messages, api_key, timeout):
+        return json.dumps(self.classify(self.last_user_message(messages)))
+
+    async def complete_batch(self, batch, api_key, timeout):
+        return [json.dumps(self.classify(self.last_user_message(messages))) for messages in batch]
+
+
+class MicroBatcher:
+    """
+    Coalesces completion requests for the same API key and `scope` that
+    arrive within `window` seconds into a single `complete_batch` call on
+    the provider. API keys are org-wide, so callers pass the end user as
+    `scope`: a batched prompt must never mix two users' conversations.
+    Providers without `supports_batch` (Telex unless TELEX_AI_BATCH=1) are
+    called directly, one request per completion.
+    """
+
+    def __init__(self, provider: LLMProvider, window: float = 0.005, max_batch: int = 16):
+        self.provider = provider
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+
+    async def complete(self, messages, api_key, timeout, scope):
+        if not self.provider.supports_batch:
+            return await self.provider.complete(messages, api_key, timeout)
+
+        future = asyncio.get_running_loop().create_future()
+        group = (api_key, scope)
+        batch = self._pending.get(group)
+        if batch is None:
+            batch = self._pending[group] = []
+            asyncio.get_running_loop().call_later(self.window, self._flush, group, batch)
+        batch.append((messages, timeout, future))
+        if len(batch) >= self.max_batch:
+            self._flush(group, batch)
+        return await future
+
+    def _flush(self, group, batch):
+        if self._pending.get(group) is not batch:
+            return
+        del self._pending[group]
+        asyncio.ensure_future(self._run(group[0], batch))
+
+    async def _run(self, api_key, batch):
+        try:
+            replies = await self.provider.complete_batch(
+                [messages for messages, _, _ in batch],
+                api_key,
+                max(timeout for _, timeout, _ in batch),
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), reply in zip(batch, replies):
+            if not future.done():
+                future.set_result(reply)
@@ -0,0 +1,225 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+
+class RateLimitBackend(ABC):
+    """
+    Storage for token buckets. Subclass and implement `take` to share
+    limiter state between workers (e.g. in Redis); the default keeps it
+    in process memory.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> tuple[bool, float]:
+        """Returns (allowed, seconds until enough tokens are available)."""
+
+    async def refund(self, key: str, rate: float, capacity: float, cost: float = 1.0):
+        """Gives back tokens taken for a request that was rejected elsewhere."""
+        # A negative cost always succeeds; both backends clamp to capacity on the next take.
+        await self.take(key, rate, capacity, -cost)
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryBackend(RateLimitBackend):
+    """
+    Buckets live in an LRU bounded by `max_buckets`. Buckets that have
+    refilled to capacity carry no state worth keeping and are swept every
+    `sweep_interval` seconds, so client-chosen org ids and keys can't grow
+    the table without bound.
+    """
+
+    def __init__(self, max_buckets: int = 100_000, sweep_interval: float = 60.0):
+        self.max_buckets = max_buckets
+        self.sweep_interval = sweep_interval
+        self._buckets = OrderedDict()
+        self._swept_at = time.monotonic()
+
+    def stats(self):
+        return {"buckets": len(self._buckets), "max_buckets": self.max_buckets}
+
+    async def take(self, key, rate, capacity, cost=1.0):
+        now = time.monotonic()
+        if now - self._swept_at >= self.sweep_interval:
+            self._sweep(now)
+
+        tokens, updated_at, _, _ = self._buckets.get(key, (capacity, now, rate, capacity))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+
+        self._buckets[key] = (tokens, now, rate, capacity)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate
+
+    def _sweep(self, now):
+        self._swept_at = now
+        full = [
+            key for key, (tokens, updated_at, rate, capacity) in self._buckets.items()
+            if tokens + (now - updated_at) * rate >= capacity
+        ]
+        for key in full:
+            del self._buckets[key]
+
+
+class RedisBackend(RateLimitBackend):
+    """Token buckets stored in Redis so every worker sees the same state.
+
+    `client` is an asyncio Redis client (e.g. `redis.asyncio.Redis`).
+    """
+
+    SCRIPT = """
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or ARGV[2])
+    local updated_at = tonumber(redis.call('HGET', KEYS[1], 'updated_at') or ARGV[4])
+    local rate, capacity, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[4]), tonumber(ARGV[3])
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local allowed = 0
+    if tokens >= cost then
+      tokens = tokens - cost
+      allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key, rate, capacity, cost=1.0):
+        allowed, tokens = await self.client.eval(
+            self.SCRIPT, 1, self.prefix + key, rate, capacity, cost, time.time()
+        )
+        if int(allowed):
+            return True, 0.0
+        return False, (cost - float(tokens)) / rate
+
+
+class RateLimiter:
+    """Token-bucket limits applied per organisation and per API key."""
+
+    def __init__(
+        self,
+        backend: RateLimitBackend | None = None,
+        org_rate: float = 5.0,
+        org_burst: float = 20.0,
+        key_rate: float = 2.0,
+        key_burst: float = 10.0,
+    ):
+        self.backend = backend or InMemoryBackend()
+        self.org_rate = org_rate
+        self.org_burst = org_burst
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+
+    async def check(self, org_id, api_key) -> tuple[str | None, float]:
+        """Returns the name of the breached limit (or None) and a retry-after in seconds."""
+        if org_id:
+            allowed, retry_after = await self.backend.take(f"org:{org_id}", self.org_rate, self.org_burst)
+            if not allowed:
+                return "org", retry_after
+
+        if api_key:
+            allowed, retry_after = await self.backend.take(f"key:{api_key}", self.key_rate, self.key_burst)
+            if not allowed:
+                # the request never ran, so it mustn't use up the org's budget
+                if org_id:
+                    await self.backend.refund(f"org:{org_id}", self.org_rate, self.org_burst)
+                return "api_key", retry_after
+
+        return None, 0.0
+
+
+class FairScheduler:
+    """
+    Runs background jobs with bounded concurrency, serving tenants in
+    weighted round-robin order so one busy tenant cannot starve the rest.
+    """
+
+    def __init__(self, concurrency: int = 8, weights: dict | None = None, default_weight: int = 1):
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self._queues = {}
+        self._credits = {}
+        self._active = deque()
+        self._available = None
+        self._workers = []
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def weight(self, tenant):
+        return max(1, int(self.weights.get(tenant, self.default_weight)))
+
+    def queued(self) -> dict:
+        return {tenant: len(queue) for tenant, queue in self._queues.items()}
+
+    def submit(self, tenant, func, *args, **kwargs):
+        if self._available is None:
+            self._available = asyncio.Semaphore(0)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+        if tenant not in self._queues:
+            self._queues[tenant] = deque()
+            self._credits[tenant] = 0
+            self._active.append(tenant)
+        self._queues[tenant].append((func, args, kwargs))
+        self._unfinished += 1
+        self._idle.clear()
+        self._available.release()
+
+    async def drain(self, timeout: float | None = None):
+        """Waits for queued and running jobs to finish (up to `timeout`), then stops the workers."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Stopping with {self._unfinished} background tasks unfinished")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._available = None
+
+    def _next(self):
+        # Deficit round robin with a cost of one per job: a tenant is topped up
+        # with `weight` credits each time it reaches the head of the rotation.
+        while True:
+            tenant = self._active[0]
+            if self._credits[tenant] < 1:
+                self._credits[tenant] += self.weight(tenant)
+                self._active.rotate(-1)
+                continue
+
+            self._credits[tenant] -= 1
+            queue = self._queues[tenant]
+            job = queue.popleft()
+            if not queue:
+                self._active.popleft()
+                del self._queues[tenant]
+                del self._credits[tenant]
+            return job
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            func, args, kwargs = self._next()
+            try:
+                await func(*args, **kwargs)
+            except Exception as e:
+                print(f"Background task failed: {e!r}")
+            finally:
+                self._unfinished -= 1
+                if not self._unfinished:
+                    self._idle.set()
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from collections import deque
+
+
+class LatencyTracker:
+    """Rolling window of call latencies (in seconds) used to derive timeouts."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._state = self.CLOSED
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN or self._probing:
+            return False
+        # In half-open state a single trial call is let through; its outcome
+        # either closes the breaker again or re-opens it for another period.
+        self._probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._state = self.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Ends a call that says nothing about upstream health (e.g. a rejected request)."""
+        self._probing = False
+
+
+class ResilientCaller:
+    """
+    Wraps an outbound call with an adaptive timeout, a hedged duplicate
+    request, a circuit breaker and a per-key concurrency limit.
+
+    `func` is called as `func(timeout)` and must return an awaitable.
+    `fallback` is called with no arguments whenever the call cannot be
+    served (breaker open, timeout or error) and its result is returned instead.
+    Only errors for which `is_failure(error)` is true count against the
+    breaker, so callers can keep client errors from tripping it for everyone.
+    """
+
+    def __init__(
+        self,
+        min_timeout: float = 2.0,
+        max_timeout: float = 15.0,
+        timeout_multiplier: float = 2.0,
+        hedge_percentile: float = 95,
+        min_samples: int = 20,
+        max_concurrency_per_key: int = 4,
+        breaker: CircuitBreaker | None = None,
+        latency: LatencyTracker | None = None,
+        is_failure=None,
+    ):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_concurrency_per_key = max_concurrency_per_key
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.is_failure = is_failure or (lambda error: True)
+        # key -> [semaphore, holders and waiters]; dropped once nobody uses it
+        self._slots = {}
+
+    def timeout(self) -> float:
+        if len(self.latency) < self.min_samples:
+            return self.max_timeout
+        p99 = self.latency.percentile(99)
+        return max(self.min_timeout, min(self.max_timeout, p99 * self.timeout_multiplier))
+
+    def hedge_delay(self) -> float | None:
+        if len(self.latency) < self.min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def call(self, key, func, fallback):
+        if not self.breaker.allow_request():
+            print("Circuit open, serving degraded response")
+            return fallback()
+
+        timeout = self.timeout()
+        started = {}
+        try:
+            result = await asyncio.wait_for(self._limited(key, func, timeout, started), timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            print(f"Outbound call failed: {e!r}")
+            if isinstance(e, asyncio.TimeoutError) and "at" not in started:
+                # Timed out waiting for a concurrency slot: the upstream was never called.
+                self.breaker.release()
+            elif self.is_failure(e):
+                if isinstance(e, asyncio.TimeoutError):
+                    # Count timeouts as samples so the adaptive timeout can grow
+                    # back when the upstream slows down instead of only shrinking.
+                    self.latency.record(timeout)
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            return fallback()
+
+        self.breaker.record_success()
+        return result
+
+    async def _limited(self, key, func, timeout, started):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = [asyncio.Semaphore(self.max_concurrency_per_key), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                started["at"] = time.monotonic()
+                return await self._hedged(func, timeout, slot[0])
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0 and self._slots.get(key) is slot:
+                del self._slots[key]
+
+    async def _attempt(self, func, timeout, semaphore=None):
+        try:
+            started = time.monotonic()
+            result = await func(timeout)
+            self.latency.record(time.monotonic() - started)
+            return result
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    async def _hedged(self, func, timeout, semaphore):
+        primary = asyncio.ensure_future(self._attempt(func, timeout))
+        pending = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            # The primary is slower than the configured percentile: race a
+            # duplicate request against it and keep whichever succeeds first.
+            # The duplicate needs its own concurrency slot, and is skipped
+            # when the key has none free.
+            if semaphore.locked():
+                return await primary
+            await semaphore.acquire()
+            pending.add(asyncio.ensure_future(self._attempt(func, timeout, semaphore)))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            # Wait for cancelled attempts so their slots are back before ours is.
+            await asyncio.gather(*pending, return_exceptions=True)
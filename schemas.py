@@ -11,6 +11,10 @@ from enum import Enum
 from typing import Annotated, Any, Literal, Self
 from uuid import uuid4
 
+# Models that the agent never instantiates on its request path build their
+# validators on first use instead of at import time, which keeps cold starts fast.
+DEFERRED = ConfigDict(defer_build=True)
+
 class TaskState(str, Enum):
     SUBMITTED = 'submitted'
     WORKING = 'working'
@@ -99,6 +103,8 @@ class Task(BaseModel):
 
 
 class TaskStatusUpdateEvent(BaseModel):
+    model_config = DEFERRED
+
     id: str
     status: TaskStatus
     final: bool = False
@@ -106,25 +112,31 @@ class TaskStatusUpdateEvent(BaseModel):
 
 
 class TaskArtifactUpdateEvent(BaseModel):
+    model_config = DEFERRED
+
     id: str
     artifact: Artifact
     metadata: dict[str, Any] | None = None
 
 
 class AuthenticationInfo(BaseModel):
-    model_config = ConfigDict(extra='allow')
+    model_config = ConfigDict(extra='allow', defer_build=True)
 
     schemes: list[str]
     credentials: str | None = None
 
 
 class PushNotificationConfig(BaseModel):
+    model_config = DEFERRED
+
     url: str
     token: str | None = None
     authentication: AuthenticationInfo | None = None
 
 
 class TaskIdParams(BaseModel):
+    model_config = DEFERRED
+
     id: str
     metadata: dict[str, Any] | None = None
 
@@ -134,6 +146,8 @@ class TaskQueryParams(TaskIdParams):
 
 
 class TaskSendParams(BaseModel):
+    model_config = DEFERRED
+
     id: str
     sessionId: str = Field(default_factory=lambda: uuid4().hex)
     message: Message
@@ -144,6 +158,8 @@ class TaskSendParams(BaseModel):
 
 
 class TaskPushNotificationConfig(BaseModel):
+    model_config = DEFERRED
+
     id: str
     pushNotificationConfig: PushNotificationConfig
 
@@ -157,6 +173,8 @@ class JSONRPCMessage(BaseModel):
 
 
 class JSONRPCRequest(JSONRPCMessage):
+    model_config = DEFERRED
+
     method: str
     params: dict[str, Any] | None = None
 
@@ -187,6 +205,8 @@ class SendTaskStreamingRequest(JSONRPCRequest):
 
 
 class SendTaskStreamingResponse(JSONRPCResponse):
+    model_config = DEFERRED
+
     result: TaskStatusUpdateEvent | TaskArtifactUpdateEvent | None = None
 
 
@@ -196,6 +216,8 @@ class GetTaskRequest(JSONRPCRequest):
 
 
 class GetTaskResponse(JSONRPCResponse):
+    model_config = DEFERRED
+
     result: Task | None = None
 
 
@@ -205,6 +227,8 @@ class CancelTaskRequest(JSONRPCRequest):
 
 
 class CancelTaskResponse(JSONRPCResponse):
+    model_config = DEFERRED
+
     result: Task | None = None
 
 
@@ -216,6 +240,8 @@ class SetTaskPushNotificationRequest(JSONRPCRequest):
 
 
 class SetTaskPushNotificationResponse(JSONRPCResponse):
+    model_config = DEFERRED
+
     result: TaskPushNotificationConfig | None = None
 
 
@@ -227,6 +253,8 @@ class GetTaskPushNotificationRequest(JSONRPCRequest):
 
 
 class GetTaskPushNotificationResponse(JSONRPCResponse):
+    model_config = DEFERRED
+
     result: TaskPushNotificationConfig | None = None
 
 
@@ -245,7 +273,8 @@ A2ARequest = TypeAdapter(
         | TaskResubscriptionRequest
         | SendTaskStreamingRequest,
         Field(discriminator='method'),
-    ]
+    ],
+    config=DEFERRED,
 )
 
 ## Error types
@@ -258,76 +287,108 @@ class JSONParseError(JSONRPCError):
 
 
 class InvalidRequestError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32600
     message: str = 'Request payload validation error'
     data: Any | None = None
 
 
 class MethodNotFoundError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32601
     message: str = 'Method not found'
     data: None = None
 
 
 class InvalidParamsError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32602
     message: str = 'Invalid parameters'
     data: Any | None = None
 
 
 class InternalError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32603
     message: str = 'Internal error'
     data: Any | None = None
 
 
 class TaskNotFoundError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32001
     message: str = 'Task not found'
     data: None = None
 
 
 class TaskNotCancelableError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32002
     message: str = 'Task cannot be canceled'
     data: None = None
 
 
 class PushNotificationNotSupportedError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32003
     message: str = 'Push Notification is not supported'
     data: None = None
 
 
 class UnsupportedOperationError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32004
     message: str = 'This operation is not supported'
     data: None = None
 
 
 class ContentTypeNotSupportedError(JSONRPCError):
+    model_config = DEFERRED
+
     code: int = -32005
     message: str = 'Incompatible content types'
     data: None = None
 
 
+class RateLimitExceededError(JSONRPCError):
+    code: int = -32010
+    message: str = 'Rate limit exceeded'
+    data: Any | None = None
+
+
 class AgentProvider(BaseModel):
+    model_config = DEFERRED
+
     organization: str
     url: str | None = None
 
 
 class AgentCapabilities(BaseModel):
+    model_config = DEFERRED
+
     streaming: bool = False
     pushNotifications: bool = False
     stateTransitionHistory: bool = False
 
 
 class AgentAuthentication(BaseModel):
+    model_config = DEFERRED
+
     schemes: list[str]
     credentials: str | None = None
 
 
 class AgentSkill(BaseModel):
+    model_config = DEFERRED
+
     id: str
     name: str
     description: str | None = None
@@ -338,6 +399,8 @@ class AgentSkill(BaseModel):
 
 
 class AgentCard(BaseModel):
+    model_config = DEFERRED
+
     name: str
     description: str | None = None
     url: str
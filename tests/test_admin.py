@@ -0,0 +1,31 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from admin import build_admin_router
+from history import HistoryCache
+from monitoring import TaskTracker
+from ratelimit import FairScheduler
+
+
+def admin_client():
+    app = FastAPI()
+    app.include_router(build_admin_router(
+        "admin-key", TaskTracker(), FairScheduler(), HistoryCache(), None, None, None,
+    ))
+    return TestClient(app)
+
+
+def test_admin_key_is_required():
+    client = admin_client()
+
+    assert client.get("/admin/tasks").status_code == 401
+    assert client.get("/admin/tasks", headers={"X-ADMIN-API-KEY": "wrong"}).status_code == 401
+    assert client.get("/admin/tasks", headers={"X-ADMIN-API-KEY": "admin-key"}).status_code == 200
+
+
+def test_non_ascii_admin_key_is_rejected_not_an_error():
+    client = admin_client()
+
+    response = client.get("/admin/tasks", headers={"X-ADMIN-API-KEY": "clé".encode()})
+
+    assert response.status_code == 401
@@ -0,0 +1,20 @@
+import asyncio
+
+import httpx
+
+import clients
+
+
+def test_pool_stats_degrades_when_pool_internals_are_missing():
+    async def scenario():
+        clients.get_client("ai")
+        clients._clients["mock"] = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        try:
+            return clients.pool_stats()
+        finally:
+            await clients.close_all()
+
+    stats = asyncio.run(scenario())
+
+    assert stats["ai"]["connections"] == 0
+    assert stats["mock"] == {"closed": False, "pool": "unavailable"}
@@ -0,0 +1,56 @@
+import json
+
+from history import ChatHistory, HistoryCache
+
+
+def make_history(*contents):
+    history = ChatHistory()
+    for index, content in enumerate(contents):
+        history.append("user" if index % 2 == 0 else "assistant", content)
+    return history
+
+
+def test_renderings_match_plain_serialisation():
+    history = make_history("my name is Idára", 'Okay, "Idára"')
+    assert history.to_prompt() == 'User: my name is Idára\nAssistant: Okay, "Idára"'
+
+    history.append("user", "what's my name?")
+    assert history.to_prompt().endswith("\nUser: what's my name?")
+    assert json.loads(history.to_json()) == history.to_messages()
+
+
+def test_cache_hands_out_independent_copies():
+    cache = HistoryCache()
+    cache.put(("org", "user"), make_history("hi", "hello"), "doc-1")
+
+    first, _ = cache.get(("org", "user"))
+    second, _ = cache.get(("org", "user"))
+    first.append("user", "turn from task A")
+    second.append("user", "turn from task B")
+
+    cached, history_id = cache.get(("org", "user"))
+    assert history_id == "doc-1"
+    assert [turn.content for turn in cached] == ["hi", "hello"]
+    assert first[-1].content == "turn from task A"
+    assert second[-1].content == "turn from task B"
+
+
+def test_cache_drops_renderings_by_default():
+    history = make_history("hi", "hello")
+    history.to_prompt()
+    history.to_json()
+    HistoryCache().put("key", history, "doc-1")
+    assert history._prompt == "" and history._json == ""
+
+    kept = make_history("hi", "hello")
+    kept.to_json()
+    HistoryCache(keep_renderings=True).put("key", kept, "doc-1")
+    assert kept._json
+
+
+def test_cache_with_no_entries_is_disabled():
+    cache = HistoryCache(max_entries=0)
+    cache.put(("org", "user"), ChatHistory.from_messages([{"role": "user", "content": "hi"}]), "doc-1")
+
+    assert len(cache) == 0
+    assert cache.get(("org", "user")) is None
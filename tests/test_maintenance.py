@@ -0,0 +1,107 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import httpx
+
+import clients
+from maintenance import MemoryMaintenance
+
+
+class MockAgentDB:
+    def __init__(self, documents):
+        self.documents = documents
+        self.deleted = []
+        self.archived = []
+        self.updated = {}
+        self.created = []
+
+    def handler(self, request):
+        if request.headers["X-AGENT-API-KEY"] == "revoked":
+            return httpx.Response(401, json={"error": "unauthorized"})
+        if request.method == "GET":
+            doc_type = json.loads(request.content)["filter"]["type"]
+            return httpx.Response(200, json={"data": [doc for doc in self.documents if doc["type"] == doc_type]})
+        if request.method == "POST":
+            self.created.append(json.loads(request.content)["document"])
+            return httpx.Response(200, json={"data": {}})
+        doc_id = request.url.path.rsplit("/", 1)[-1]
+        if request.method == "DELETE":
+            self.deleted.append(doc_id)
+        elif request.method == "PUT":
+            self.archived.append(doc_id)
+            self.updated[doc_id] = json.loads(request.content)["document"]
+        return httpx.Response(200, json={"data": {}})
+
+
+def run_maintenance(db, api_keys, **kwargs):
+    async def scenario():
+        clients._clients["agent_db"] = httpx.AsyncClient(transport=httpx.MockTransport(db.handler))
+        try:
+            maintenance = MemoryMaintenance(base_url="http://agent-db", **kwargs)
+            for api_key in api_keys:
+                maintenance.register(api_key)
+            return maintenance, await maintenance.run()
+        finally:
+            await clients.close_all()
+
+    return asyncio.run(scenario())
+
+
+def fact(doc_id, key, created_at):
+    return {"_id": doc_id, "type": "user_information", "user_id": "u1", "key": key, "value": doc_id, "created_at": created_at}
+
+
+def test_collapses_duplicates_and_expires_facts():
+    now = datetime.now()
+    db = MockAgentDB([
+        fact("old-color", "color", (now - timedelta(days=2)).isoformat()),
+        fact("new-color", "color", (now - timedelta(days=1)).isoformat()),
+        fact("ancient-name", "name", (now - timedelta(days=90)).isoformat()),
+        fact("undated", "city", None),
+        fact("garbled", "city", "yesterday"),
+    ])
+    _, report = run_maintenance(db, ["key"], fact_ttl=timedelta(days=30))
+
+    assert sorted(db.deleted) == ["ancient-name", "old-color"]
+    assert report["facts_deduplicated"] == 1
+    assert report["facts_expired"] == 1
+    assert report["reclaimed"] == 2
+
+
+def test_failing_key_does_not_abort_run_and_is_dropped():
+    now = datetime.now()
+    db = MockAgentDB([
+        fact("a", "color", (now - timedelta(days=2)).isoformat()),
+        fact("b", "color", (now - timedelta(days=1)).isoformat()),
+    ])
+    maintenance, report = run_maintenance(db, ["revoked", "key"], fact_ttl=timedelta(days=30))
+
+    assert db.deleted == ["a"]
+    assert report["keys_failed"] == 1
+    assert report["keys_dropped"] == 1
+    assert list(maintenance.api_keys) == ["key"]
+
+
+def history(doc_id, messages, updated_at):
+    return {
+        "_id": doc_id, "type": "user_history", "user_id": "u1", "updated_at": updated_at,
+        "messages": [{"role": "user", "content": str(n)} for n in range(messages)],
+    }
+
+
+def test_splits_old_segments_off_long_histories():
+    now = datetime.now()
+    db = MockAgentDB([
+        history("long", 10, (now - timedelta(hours=1)).isoformat()),
+        history("busy", 10, now.isoformat()),
+        history("short", 3, (now - timedelta(hours=1)).isoformat()),
+    ])
+    _, report = run_maintenance(db, ["key"], history_max_messages=4)
+
+    assert report["history_segments_archived"] == 1
+    assert [message["content"] for message in db.updated["long"]["messages"]] == ["6", "7", "8", "9"]
+    assert db.created[0]["type"] == "user_history_archive"
+    assert db.created[0]["history_id"] == "long"
+    assert len(db.created[0]["messages"]) == 6
+    assert list(db.updated) == ["long"]
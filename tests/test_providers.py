@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import httpx
+
+import clients
+from providers import LocalProvider, MicroBatcher, TelexProvider
+
+
+class MockTelex:
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+
+    def handler(self, request):
+        messages = json.loads(request.content)["messages"]
+        self.requests.append(messages)
+        if messages[0]["role"] == "system" and "independent tasks" in messages[0]["content"]:
+            content = self.reply
+        else:
+            content = json.dumps({"intent": "chat", "data": {"key": "reply", "value": messages[-1]["content"]}})
+        return httpx.Response(200, json={"data": {"Messages": {"content": content}}})
+
+
+def run_batch(telex, batch):
+    async def scenario():
+        clients._clients["ai"] = httpx.AsyncClient(transport=httpx.MockTransport(telex.handler))
+        try:
+            provider = TelexProvider(url="http://telex/chat", model="test", organisation_id="org", batch=True)
+            return await provider.complete_batch(batch, "key", timeout=1.0)
+        finally:
+            await clients.close_all()
+
+    return asyncio.run(scenario())
+
+
+BATCH = [
+    [{"role": "user", "content": "first"}],
+    [{"role": "user", "content": "second"}],
+]
+
+
+def test_batch_is_sent_as_one_call_and_split_in_order():
+    telex = MockTelex(json.dumps([{"intent": "recall"}, {"intent": "chat"}]))
+
+    replies = run_batch(telex, BATCH)
+
+    assert len(telex.requests) == 1
+    assert "<task 2>\nsecond\n</task 2>" in telex.requests[0][1]["content"]
+    assert [json.loads(reply)["intent"] for reply in replies] == ["recall", "chat"]
+
+
+def test_mismatched_batch_reply_falls_back_to_individual_calls():
+    telex = MockTelex(json.dumps([{"intent": "recall"}]))
+
+    replies = run_batch(telex, BATCH)
+
+    assert len(telex.requests) == 3
+    assert [json.loads(reply)["data"]["value"] for reply in replies] == ["first", "second"]
+
+
+class RecordingProvider(LocalProvider):
+    def __init__(self):
+        self.batches = []
+
+    async def complete_batch(self, batch, api_key, timeout):
+        self.batches.append(len(batch))
+        return await super().complete_batch(batch, api_key, timeout)
+
+
+def prompt(message):
+    return [{"role": "system", "content": f"User: {message}"}]
+
+
+def test_batches_never_mix_users_sharing_an_api_key():
+    provider = RecordingProvider()
+
+    async def scenario():
+        batcher = MicroBatcher(provider, window=0.01)
+        return await asyncio.gather(
+            batcher.complete(prompt("what is my name?"), "org-key", 1.0, scope=("org", "alice")),
+            batcher.complete(prompt("my name is Bob"), "org-key", 1.0, scope=("org", "bob")),
+            batcher.complete(prompt("what is my dog?"), "org-key", 1.0, scope=("org", "alice")),
+        )
+
+    replies = asyncio.run(scenario())
+
+    assert sorted(provider.batches) == [1, 2]
+    assert [json.loads(reply)["intent"] for reply in replies] == ["recall", "remember", "recall"]
+
+
+def test_requests_within_the_window_are_coalesced():
+    provider = RecordingProvider()
+
+    async def scenario():
+        batcher = MicroBatcher(provider, window=0.01)
+        return await asyncio.gather(*[
+            batcher.complete(prompt(f"what is my item {n}?"), "key", 1.0, scope="user") for n in range(5)
+        ])
+
+    replies = asyncio.run(scenario())
+
+    assert provider.batches == [5]
+    assert [json.loads(reply)["data"]["key"] for reply in replies] == [f"item {n}" for n in range(5)]
+
+
+def test_max_batch_flushes_without_waiting_for_the_window():
+    provider = RecordingProvider()
+
+    async def scenario():
+        batcher = MicroBatcher(provider, window=10, max_batch=3)
+        await asyncio.wait_for(asyncio.gather(*[
+            batcher.complete(prompt("hi"), "key", 1.0, scope="user") for _ in range(3)
+        ]), 1)
+
+    asyncio.run(scenario())
+
+    assert provider.batches == [3]
+
+
+def test_a_failed_batch_fails_every_request_in_it():
+    class FailingProvider(LocalProvider):
+        async def complete_batch(self, batch, api_key, timeout):
+            raise RuntimeError("upstream down")
+
+    async def scenario():
+        batcher = MicroBatcher(FailingProvider(), window=0.01)
+        return await asyncio.gather(*[
+            batcher.complete(prompt("hi"), "key", 1.0, scope="user") for _ in range(3)
+        ], return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert [type(result) for result in results] == [RuntimeError] * 3
+
+
+def test_local_provider_is_deterministic():
+    provider = LocalProvider()
+
+    assert provider.classify("My favourite colour is green.") == {
+        "intent": "remember", "data": {"key": "favourite colour", "value": "green"},
+    }
+    assert provider.classify("What is my favourite colour?") == {
+        "intent": "recall", "data": {"key": "favourite colour"},
+    }
+    assert provider.classify("thanks!")["intent"] == "chat"
+    # the last "User:" line of the prompt is the one classified
+    messages = [{"role": "system", "content": "Chat history:\nUser: my name is Ann\nAssistant: ok\nUser: what's my name?"}]
+    replies = asyncio.run(provider.complete_batch([messages, messages], "key", 1.0))
+    assert replies == [json.dumps({"intent": "recall", "data": {"key": "name"}})] * 2
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from ratelimit import FairScheduler, InMemoryBackend, RateLimitBackend, RateLimiter
+
+
+def test_limits_per_org_and_key():
+    async def scenario():
+        limiter = RateLimiter(org_rate=1, org_burst=2, key_rate=1, key_burst=100)
+        results = [await limiter.check("org", "key") for _ in range(3)]
+        assert [breached for breached, _ in results] == [None, None, "org"]
+        assert results[2][1] > 0
+
+    asyncio.run(scenario())
+
+
+def test_in_memory_buckets_are_bounded():
+    async def scenario():
+        backend = InMemoryBackend(max_buckets=100)
+        limiter = RateLimiter(backend=backend)
+        for i in range(1000):
+            await limiter.check(f"org-{i}", f"key-{i}")
+        assert backend.stats()["buckets"] == 100
+
+    asyncio.run(scenario())
+
+
+def test_refilled_buckets_are_swept():
+    async def scenario():
+        backend = InMemoryBackend(sweep_interval=0)
+        for i in range(50):
+            await backend.take(f"idle-{i}", rate=1000, capacity=1)
+        await asyncio.sleep(0.01)
+        await backend.take("busy", rate=0.001, capacity=1)
+        assert backend.stats()["buckets"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_backend_must_implement_take():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+
+def test_key_rejection_refunds_the_org_token():
+    async def scenario():
+        limiter = RateLimiter(org_rate=0.001, org_burst=3, key_rate=0.001, key_burst=1)
+        assert (await limiter.check("org", "busy-key"))[0] is None
+        for _ in range(5):
+            assert (await limiter.check("org", "busy-key"))[0] == "api_key"
+        # only the one admitted request was charged to the org
+        assert (await limiter.check("org", "other-key"))[0] is None
+        assert (await limiter.check("org", "third-key"))[0] is None
+        assert (await limiter.check("org", "fourth-key"))[0] == "org"
+
+    asyncio.run(scenario())
+
+
+def test_fair_scheduler_interleaves_tenants_by_weight():
+    async def scenario():
+        scheduler = FairScheduler(concurrency=1, weights={"big": 2})
+        order = []
+        done = asyncio.Event()
+
+        async def job(tenant):
+            order.append(tenant)
+            if len(order) == 9:
+                done.set()
+
+        for _ in range(6):
+            scheduler.submit("big", job, "big")
+        for _ in range(3):
+            scheduler.submit("small", job, "small")
+        await asyncio.wait_for(done.wait(), 1)
+        return order
+
+    assert asyncio.run(scenario()) == ["big", "big", "small"] * 3
+
+
+def test_fair_scheduler_survives_failing_jobs():
+    async def scenario():
+        scheduler = FairScheduler(concurrency=1)
+        done = asyncio.Event()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def succeed():
+            done.set()
+
+        scheduler.submit("org", fail)
+        scheduler.submit("org", succeed)
+        await asyncio.wait_for(done.wait(), 1)
+
+    asyncio.run(scenario())
+
+
+def test_rejected_request_gets_a_json_rpc_rate_limit_error(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(org_rate=1, org_burst=0))
+    body = {
+        "jsonrpc": "2.0",
+        "id": "req-1",
+        "method": "message/send",
+        "params": {
+            "message": {
+                "role": "user",
+                "parts": [{"kind": "text", "text": "hello"}],
+                "metadata": {"telex_user_id": "user", "org_id": "org"},
+            },
+            "configuration": {
+                "pushNotificationConfig": {"url": "http://webhook", "authentication": {"credentials": "key"}},
+            },
+        },
+    }
+
+    response = TestClient(main.app).post("/", json=body)
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "req-1"
+    assert response.json()["error"]["code"] == -32010
+    assert response.json()["error"]["data"]["limit"] == "org"
+    assert response.json()["error"]["data"]["retry_after"] > 0
+    assert main.task_tracker.tasks == {}
+
+
+def test_fair_scheduler_drain_waits_for_running_jobs():
+    async def scenario():
+        scheduler = FairScheduler(concurrency=2)
+        finished = []
+
+        async def job(n):
+            await asyncio.sleep(0.01)
+            finished.append(n)
+
+        for n in range(5):
+            scheduler.submit("org", job, n)
+        await scheduler.drain(timeout=1)
+        return sorted(finished)
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+import httpx
+
+from resilience import CircuitBreaker, ResilientCaller
+
+
+class MockUpstream:
+    """In-process AI upstream with scripted per-request latency and status."""
+
+    def __init__(self, latency=0.01, status=200):
+        self.latency = latency
+        self.status = status
+        self.script = []
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handler(self, request):
+        self.requests += 1
+        latency, status = self.script.pop(0) if self.script else (self.latency, self.status)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            self.in_flight -= 1
+        return httpx.Response(status, json={"content": "ok"})
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler), base_url="http://ai")
+
+
+def make_request(client):
+    async def request_ai(timeout):
+        response = await client.post("/chat", timeout=timeout)
+        response.raise_for_status()
+        return response.json()["content"]
+    return request_ai
+
+
+def is_upstream_failure(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return True
+
+
+def caller(**kwargs):
+    options = dict(min_timeout=0.05, max_timeout=2.0, min_samples=10, is_failure=is_upstream_failure)
+    options.update(kwargs)
+    return ResilientCaller(**options)
+
+
+async def warm_up(resilient, client, calls=10):
+    for _ in range(calls):
+        assert await resilient.call("key", make_request(client), lambda: "fallback") == "ok"
+
+
+def test_adaptive_timeout_follows_observed_latency():
+    async def scenario():
+        upstream = MockUpstream(latency=0.01)
+        resilient = caller(hedge_percentile=100)
+        async with upstream.client() as client:
+            assert resilient.timeout() == 2.0
+            await warm_up(resilient, client)
+            assert 0.05 <= resilient.timeout() < 0.2
+
+            upstream.script = [(1.0, 200), (1.0, 200)]
+            started = time.monotonic()
+            result = await resilient.call("key", make_request(client), lambda: "fallback")
+            assert result == "fallback"
+            assert time.monotonic() - started < 0.5
+
+    asyncio.run(scenario())
+
+
+def test_hedge_fires_after_p95_and_wins_latency_spike():
+    async def scenario():
+        upstream = MockUpstream(latency=0.01)
+        resilient = caller(max_timeout=2.0, min_timeout=1.0)
+        async with upstream.client() as client:
+            await warm_up(resilient, client)
+            before = upstream.requests
+
+            upstream.script = [(0.5, 200), (0.01, 200)]
+            started = time.monotonic()
+            assert await resilient.call("key", make_request(client), lambda: "fallback") == "ok"
+            assert time.monotonic() - started < 0.3
+            assert upstream.requests - before == 2
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_and_half_open_allows_one_probe():
+    async def scenario():
+        upstream = MockUpstream(latency=0.01, status=503)
+        resilient = caller(breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.1))
+        async with upstream.client() as client:
+            for _ in range(3):
+                assert await resilient.call("key", make_request(client), lambda: "fallback") == "fallback"
+            assert resilient.breaker.state == CircuitBreaker.OPEN
+
+            # open: fail fast without touching the upstream
+            requests = upstream.requests
+            assert await resilient.call("key", make_request(client), lambda: "fallback") == "fallback"
+            assert upstream.requests == requests
+
+            await asyncio.sleep(0.15)
+            upstream.status, upstream.latency = 200, 0.05
+            results = await asyncio.gather(*[
+                resilient.call(f"key-{i}", make_request(client), lambda: "fallback") for i in range(5)
+            ])
+            assert upstream.requests == requests + 1
+            assert sorted(results) == ["fallback"] * 4 + ["ok"]
+            assert resilient.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_client_errors_do_not_open_breaker_for_other_keys():
+    async def scenario():
+        upstream = MockUpstream(latency=0.01, status=401)
+        resilient = caller(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        async with upstream.client() as client:
+            for _ in range(5):
+                assert await resilient.call("bad-key", make_request(client), lambda: "fallback") == "fallback"
+            assert resilient.breaker.state == CircuitBreaker.CLOSED
+
+            upstream.status = 200
+            assert await resilient.call("good-key", make_request(client), lambda: "fallback") == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_is_limited_per_key_including_hedges():
+    async def scenario():
+        upstream = MockUpstream(latency=0.01)
+        resilient = caller(max_concurrency_per_key=2, min_timeout=1.0)
+        async with upstream.client() as client:
+            await warm_up(resilient, client)
+
+            # every request is now slow enough to trigger a hedge
+            upstream.latency = 0.1
+            upstream.max_in_flight = 0
+            results = await asyncio.gather(*[
+                resilient.call("key", make_request(client), lambda: "fallback") for _ in range(6)
+            ])
+            assert results == ["ok"] * 6
+            assert upstream.max_in_flight <= 2
+            assert resilient._slots == {}
+
+    asyncio.run(scenario())
+
+
+def test_queueing_for_a_slot_counts_against_the_timeout():
+    async def scenario():
+        upstream = MockUpstream(latency=0.3)
+        resilient = caller(max_concurrency_per_key=1, max_timeout=0.5, min_samples=1000)
+        async with upstream.client() as client:
+            started = time.monotonic()
+            results = await asyncio.gather(*[
+                resilient.call("key", make_request(client), lambda: "fallback") for _ in range(3)
+            ])
+            assert time.monotonic() - started < 0.8
+            assert results[0] == "ok"
+            assert results[1:] == ["fallback", "fallback"]
+            # the third call timed out still queued for a slot, which is not an
+            # upstream failure; only the second, cut off mid-request, counts
+            assert resilient.breaker.failures == 1
+
+    asyncio.run(scenario())
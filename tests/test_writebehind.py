@@ -0,0 +1,159 @@
+import asyncio
+import os
+
+from history import ChatHistory
+from writebehind import WriteBehindBuffer
+
+
+class MockAgentDB:
+    def __init__(self):
+        self.persisted = []
+
+    async def persist(self, entry):
+        self.persisted.append((entry.key, entry.api_key, len(entry.history)))
+        return entry.history_id or f"doc-{len(self.persisted)}"
+
+
+def history(*contents):
+    return ChatHistory.from_messages([{"role": "user", "content": content} for content in contents])
+
+
+def crash(buffer):
+    # what the OS does to a killed worker: its files close and its flock goes away
+    buffer._journal._file.close()
+    buffer._journal._lock.close()
+
+
+def journal_text(root):
+    text = ""
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.endswith(".jsonl"):
+                with open(os.path.join(directory, name)) as segment:
+                    text += segment.read()
+    return text
+
+
+def test_journal_holds_a_key_reference_not_the_key(tmp_path):
+    async def scenario():
+        buffer = WriteBehindBuffer(MockAgentDB().persist, journal_dir=str(tmp_path), flush_delay=60)
+        await buffer.replay()
+        await buffer.write(("org", "user"), history("hi"), None, "secret-key", "user", "org")
+        return journal_text(tmp_path)
+
+    text = asyncio.run(scenario())
+
+    assert "secret-key" not in text
+    assert '"key_ref"' in text
+
+
+def test_replayed_entries_wait_for_the_tenant_to_supply_the_key(tmp_path):
+    db = MockAgentDB()
+
+    async def scenario():
+        crashed = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=60)
+        await crashed.replay()
+        await crashed.write(("org", "user"), history("hi", "again"), "doc-1", "secret-key", "user", "org")
+        crash(crashed)
+
+        buffer = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=0)
+        await buffer.replay()
+        await buffer.flush_all()
+        parked = (len(buffer), buffer.awaiting_key, list(db.persisted))
+
+        buffer.supply_key("other-key")
+        buffer.supply_key("secret-key")
+        await asyncio.sleep(0.01)
+        await buffer.close()
+        return parked, len(buffer)
+
+    parked, pending = asyncio.run(scenario())
+
+    assert parked == (1, 1, [])
+    assert db.persisted == [(("org", "user"), "secret-key", 2)]
+    assert pending == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_live_journals_are_not_claimed_and_flushed_keys_are_not_replayed(tmp_path):
+    db = MockAgentDB()
+
+    async def scenario():
+        live = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=60)
+        await live.replay()
+        await live.write(("org", "live"), history("hi"), None, "key", "live", "org")
+
+        crashed = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=60)
+        await crashed.replay()
+        await crashed.write(("org", "done"), history("hi"), None, "key", "done", "org")
+        await crashed.write(("org", "open"), history("hi"), None, "key", "open", "org")
+        await crashed.flush(("org", "done"))
+        crash(crashed)
+
+        buffer = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=60)
+        await buffer.replay()
+        return sorted(key for key in buffer._pending), len(os.listdir(tmp_path))
+
+    replayed, journals = asyncio.run(scenario())
+
+    assert replayed == [("org", "open")]
+    # the live worker's journal and the new worker's own; the crashed one was adopted and removed
+    assert journals == 2
+
+
+def test_flushed_segments_are_dropped_and_pinned_ones_compacted(tmp_path):
+    db = MockAgentDB()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=60,
+                                   segment_bytes=1, max_segments=3)
+        await buffer.replay()
+        await buffer.write(("org", "stuck"), history("hi"), None, "key", "stuck", "org")
+        buffer._pending[("org", "stuck")].api_key = None  # never flushes, pinning its segment
+        for n in range(10):
+            await buffer.write(("org", f"user-{n}"), history("hi"), None, "key", f"user-{n}", "org")
+            await buffer.flush(("org", f"user-{n}"))
+        return list(buffer._journal.segments), journal_text(tmp_path)
+
+    segments, text = asyncio.run(scenario())
+
+    assert len(segments) <= 3
+    assert '"stuck"' in text
+    assert '"user-0"' not in text
+
+
+def test_reads_see_the_latest_write_throughout_a_flush(tmp_path):
+    key = ("org", "user")
+    cache = {key: history("stale", "stale")}
+
+    async def scenario():
+        buffer = WriteBehindBuffer(MockAgentDB().persist, journal_dir=str(tmp_path), flush_delay=60,
+                                   on_flushed=lambda entry: cache.__setitem__(entry.key, entry.history))
+        await buffer.replay()
+        await buffer.write(key, history("a", "b", "c", "d"), None, "key", "user", "org")
+
+        seen = []
+        flush = asyncio.ensure_future(buffer.flush(key))
+        while not flush.done():
+            pending = buffer.get(key)
+            seen.append(len(pending.history if pending else cache[key]))
+            await asyncio.sleep(0)
+        return seen
+
+    assert set(asyncio.run(scenario())) == {4}
+
+
+def test_writes_after_close_are_flushed_directly(tmp_path):
+    db = MockAgentDB()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db.persist, journal_dir=str(tmp_path), flush_delay=60)
+        await buffer.replay()
+        await buffer.write(("org", "early"), history("hi"), None, "key", "early", "org")
+        await buffer.flush_all()
+        await buffer.close()
+        await buffer.write(("org", "late"), history("hi"), None, "key", "late", "org")
+        return len(buffer)
+
+    assert asyncio.run(scenario()) == 0
+    assert [key for key, _, _ in db.persisted] == [("org", "early"), ("org", "late")]
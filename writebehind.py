@@ -0,0 +1,364 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from uuid import uuid4
+
+from history import ChatHistory
+
+
+def api_key_ref(api_key: str) -> str:
+    """Stands in for an API key in the journal: enough to match it again, not to use it."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:32]
+
+
+class PendingHistory:
+    __slots__ = ("key", "history", "messages_json", "history_id", "api_key", "key_ref", "user_id", "org_id",
+                 "written_at", "segment")
+
+    def __init__(self, key, history, messages_json, history_id, api_key, user_id, org_id, key_ref=None):
+        self.key = key
+        self.history = history
+        self.messages_json = messages_json
+        self.history_id = history_id
+        self.api_key = api_key
+        self.key_ref = key_ref or api_key_ref(api_key)
+        self.user_id = user_id
+        self.org_id = org_id
+        self.written_at = time.monotonic()
+        self.segment = None
+
+    def to_journal(self) -> str:
+        meta = {
+            "key": list(self.key),
+            "history_id": self.history_id,
+            "key_ref": self.key_ref,
+            "user_id": self.user_id,
+            "org_id": self.org_id,
+        }
+        return f'{{"meta": {json.dumps(meta)}, "messages": {self.messages_json}}}\n'
+
+    @classmethod
+    def from_journal(cls, record: dict):
+        # Replayed entries come back without their API key; they wait for the
+        # tenant's next request to supply it (see WriteBehindBuffer.supply_key).
+        meta = record["meta"]
+        history = ChatHistory.from_messages(record["messages"])
+        return cls(
+            tuple(meta["key"]), history, history.to_json(),
+            meta["history_id"], None, meta["user_id"], meta["org_id"], key_ref=meta["key_ref"],
+        )
+
+
+class SegmentedJournal:
+    """
+    Append-only journal split into numbered segment files, in a directory
+    owned by this process. The directory is flock'ed for the life of the
+    process, which is how other workers tell a live journal from one left
+    behind by a crash. Every method does blocking I/O; call them from a
+    worker thread, one at a time.
+    """
+
+    def __init__(self, root: str, segment_bytes: int = 4 * 1024 * 1024, fsync: bool = False):
+        self.root = root
+        self.directory = os.path.join(root, f"{os.getpid()}-{uuid4().hex[:8]}")
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.segments = []
+        self._file = None
+        self._lock = None
+        self._claimed = []
+
+    @property
+    def active(self) -> int:
+        return self.segments[-1]
+
+    def open(self):
+        # Lock the directory before it becomes visible under its real name,
+        # so a concurrent claim_orphans never sees it unlocked.
+        os.makedirs(self.root, exist_ok=True)
+        staging = os.path.join(self.root, "." + os.path.basename(self.directory))
+        os.makedirs(staging)
+        self._lock = open(os.path.join(staging, "lock"), "w")
+        fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(staging, self.directory)
+        self.roll()
+
+    def claim_orphans(self) -> list[str]:
+        """Locks the journals of workers that are no longer running and returns their records, oldest first."""
+        lines = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or path == self.directory or not os.path.isdir(path):
+                continue
+            lock = open(os.path.join(path, "lock"), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                continue
+            self._claimed.append((path, lock))
+            for number in self._segment_numbers(path):
+                with open(os.path.join(path, f"{number:08d}.jsonl")) as segment:
+                    lines.extend(segment)
+        return lines
+
+    def drop_claimed(self):
+        for path, lock in self._claimed:
+            shutil.rmtree(path, ignore_errors=True)
+            lock.close()
+        self._claimed = []
+
+    def append(self, lines) -> int:
+        """Appends `lines` to the active segment, rolling over once it is full; returns the segment written."""
+        if self._file.tell() >= self.segment_bytes:
+            self.roll()
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        return self.active
+
+    def roll(self):
+        if self._file:
+            self._file.close()
+        self.segments.append(self.segments[-1] + 1 if self.segments else 1)
+        self._file = open(self._segment_path(self.active), "a")
+
+    def compact(self, lines) -> int:
+        """Rewrites `lines` (every live record) into a fresh segment and deletes all older ones."""
+        self.roll()
+        self.append(lines)
+        self.drop(self.segments[:-1])
+        return self.active
+
+    def drop(self, numbers):
+        for number in numbers:
+            self.segments.remove(number)
+            os.remove(self._segment_path(number))
+
+    def close(self, remove: bool = False):
+        self._file.close()
+        if remove:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self._lock.close()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{number:08d}.jsonl")
+
+    @staticmethod
+    def _segment_numbers(path):
+        return sorted(int(name.split(".")[0]) for name in os.listdir(path) if name.endswith(".jsonl"))
+
+
+class WriteBehindBuffer:
+    """
+    Acknowledges history writes in memory and persists them asynchronously.
+
+    Writes for the same key within `flush_delay` seconds are coalesced into
+    one flush of the latest snapshot. Every write is appended to a journal
+    under `journal_dir` first, so unflushed turns survive a crash and are
+    replayed by the next worker to start. `persist(entry)` performs the
+    actual write and returns the document id; `on_flushed(entry)` is called
+    once a key is clean.
+
+    The journal never holds API keys. Replayed entries are parked until
+    `supply_key` is called with a key that matches their reference.
+
+    Reads see their own writes only within this process; with several
+    workers, a user's turns must be routed to the same one.
+    """
+
+    def __init__(self, persist, journal_dir: str | None = None, flush_delay: float = 1.0,
+                 retry_delay: float = 5.0, fsync: bool = False, on_flushed=None,
+                 segment_bytes: int = 4 * 1024 * 1024, max_segments: int = 8):
+        self.persist = persist
+        self.flush_delay = flush_delay
+        self.retry_delay = retry_delay
+        self.on_flushed = on_flushed
+        self.max_segments = max_segments
+        self.flushed = 0
+        self.failed = 0
+        self._journal = SegmentedJournal(journal_dir, segment_bytes, fsync) if journal_dir else None
+        self._journal_lock = asyncio.Lock()
+        self._journal_queue = []
+        self._pending = {}
+        self._scheduled = {}
+        self._locks = {}
+        self._awaiting_key = {}
+        self._closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def awaiting_key(self) -> int:
+        return sum(len(keys) for keys in self._awaiting_key.values())
+
+    def get(self, key) -> PendingHistory | None:
+        return self._pending.get(key)
+
+    async def write(self, key, history: ChatHistory, history_id, api_key, user_id, org_id):
+        previous = self._pending.get(key)
+        if previous and not history_id:
+            history_id = previous.history_id
+
+        entry = PendingHistory(key, history, history.to_json(), history_id, api_key, user_id, org_id)
+        self._pending[key] = entry
+        if self._closed:
+            # the journal is gone and nothing will flush later; write through
+            await self.flush(key)
+            return
+        await self._record(entry.to_journal(), entry)
+        self._schedule(key, self.flush_delay)
+
+    def supply_key(self, api_key):
+        """Resumes replayed entries that were waiting for `api_key`."""
+        if not self._awaiting_key:
+            return
+        for key in self._awaiting_key.pop(api_key_ref(api_key), ()):
+            entry = self._pending.get(key)
+            if entry is not None and entry.api_key is None:
+                entry.api_key = api_key
+                self._schedule(key, 0)
+
+    def _schedule(self, key, delay):
+        # Only the first write in a window schedules a flush, which bounds how
+        # long any turn can sit in memory to `flush_delay`.
+        if key not in self._scheduled:
+            self._scheduled[key] = asyncio.get_running_loop().call_later(
+                delay, lambda: asyncio.ensure_future(self.flush(key))
+            )
+
+    async def flush(self, key):
+        handle = self._scheduled.pop(key, None)
+        if handle:
+            handle.cancel()
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._pending.get(key)
+            if entry is None or entry.api_key is None:
+                return
+
+            try:
+                history_id = await self.persist(entry)
+            except Exception as e:
+                print(f"History flush failed for {key}: {e!r}")
+                self.failed += 1
+                self._schedule(key, self.retry_delay)
+                return
+
+            self.flushed += 1
+            current = self._pending.get(key)
+            if current is not entry:
+                # A newer turn arrived while this one was in flight; it must
+                # update the document that was just created rather than add another.
+                if not current.history_id:
+                    current.history_id = history_id
+                    await self._record(current.to_journal(), current)
+                self._schedule(key, self.flush_delay)
+                return
+
+            entry.history_id = history_id or entry.history_id
+            # Hand the entry over (e.g. to the history cache) before it leaves
+            # `_pending`, so readers never fall back to an older copy meanwhile.
+            if self.on_flushed:
+                self.on_flushed(entry)
+            del self._pending[key]
+            await self._record(json.dumps({"flushed": list(key)}) + "\n")
+            await self._collect()
+
+        if not lock.locked():
+            self._locks.pop(key, None)
+
+    async def flush_all(self):
+        await asyncio.gather(*[self.flush(key) for key in list(self._pending)])
+
+    async def replay(self):
+        """Opens this worker's journal and takes over the journals of workers that died with unflushed writes."""
+        if not self._journal:
+            return
+
+        async with self._journal_lock:
+            if not self._journal.segments:
+                await asyncio.to_thread(self._journal.open)
+            lines = await asyncio.to_thread(self._journal.claim_orphans)
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if "flushed" in record:
+                    self._pending.pop(tuple(record["flushed"]), None)
+                    continue
+                entry = PendingHistory.from_journal(record)
+            except (ValueError, KeyError):
+                # a torn final line from a crash mid-append
+                continue
+            self._pending[entry.key] = entry
+
+        if lines:
+            for entry in self._pending.values():
+                self._awaiting_key.setdefault(entry.key_ref, set()).add(entry.key)
+            print(f"Replaying {len(self._pending)} unflushed histories from orphaned journals")
+            # Move the survivors into our own journal before deleting the orphans.
+            await self._compact()
+            await asyncio.to_thread(self._journal.drop_claimed)
+
+    async def close(self):
+        """Closes the journal; it is removed when nothing is left unflushed."""
+        self._closed = True
+        if not self._journal or not self._journal.segments:
+            return
+        async with self._journal_lock:
+            await asyncio.to_thread(self._journal.close, not self._pending)
+
+    async def _record(self, line, entry=None):
+        if not self._journal or self._closed:
+            return
+
+        # Group commit: whoever holds the lock writes every line queued so
+        # far in one append, so concurrent writers share a single disk write.
+        self._journal_queue.append((line, entry))
+        async with self._journal_lock:
+            if not self._journal_queue:
+                return
+            if not self._journal.segments:
+                await asyncio.to_thread(self._journal.open)
+            batch, self._journal_queue = self._journal_queue, []
+            try:
+                segment = await asyncio.to_thread(self._journal.append, [line for line, _ in batch])
+            except OSError as e:
+                print(f"History journal append failed: {e!r}")
+                return
+            for _, written in batch:
+                if written is not None:
+                    written.segment = segment
+
+    async def _collect(self):
+        # Segments are only ever deleted oldest first: a later segment may hold
+        # the "flushed" marker that cancels a record in an earlier one.
+        if not self._journal or self._closed:
+            return
+
+        async with self._journal_lock:
+            live = [entry.segment for entry in self._pending.values() if entry.segment is not None]
+            oldest_live = min(live, default=self._journal.active)
+            dead = [number for number in self._journal.segments[:-1] if number < oldest_live]
+            if dead:
+                await asyncio.to_thread(self._journal.drop, dead)
+
+        if len(self._journal.segments) > self.max_segments:
+            # Long-pending keys (e.g. a tenant whose flushes keep failing) pin
+            # old segments; copy what is live forward so the rest can go.
+            await self._compact()
+
+    async def _compact(self):
+        async with self._journal_lock:
+            entries = list(self._pending.values())
+            segment = await asyncio.to_thread(self._journal.compact, [entry.to_journal() for entry in entries])
+            for entry in entries:
+                entry.segment = segment